@@ -0,0 +1,122 @@
+# generate.py
+# Synthetic CUR2, legacy CUR and FOCUS files for the benchmarks, generated by DuckDB at any scale.
+#
+# Usage Examples:
+#   python benchmarks/generate.py --format cur2 --rows 10000000 --output /tmp/cur2_10m.parquet
+#   python benchmarks/generate.py --format focus --rows 1000000 --accounts 50 --tag-keys 20 --output /tmp/focus_1m.parquet
+#
+# Knobs:
+#   --rows            Number of rows
+#   --accounts        Distinct AWS account IDs (shared by the payer, usage account and ARN account columns)
+#   --arns            Distinct ARNs
+#   --resources       Distinct resource IDs
+#   --tag-keys        Number of tag keys per row (the width of the tag JSON or map)
+#
+# Every value is derived from hash(row number), so the same knobs always produce the same file.
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'python')))
+from anonymiser_common import connect, sql_string
+
+FORMATS = ("cur2", "legacy", "focus")
+PRODUCTS = ["AmazonEC2", "AmazonS3", "AmazonRDS", "AWSLambda", "AmazonCloudFront", "AmazonDynamoDB"]
+
+# Columns each format's generated file uses for the mapped values, so the benchmark can configure them
+COLUMNS = {
+    "cur2": {"resource": "line_item_resource_id", "period": "line_item_usage_start_date"},
+    "legacy": {"resource": "lineItem/ResourceId", "period": "lineItem/UsageStartDate"},
+    "focus": {"resource": "ResourceId", "period": "ChargePeriodStart"},
+}
+
+
+def _value_sql(salt: int, distinct: int) -> str:
+    """
+    A pseudo-random number in [0, distinct) for row i, independent for each salt.
+    """
+    return f"(hash(i * {salt} + {salt}) % {max(1, int(distinct))})"
+
+
+def synthetic_select(fmt: str, rows: int, accounts: int = 100, arns: int = 10000, resources: int = 100000,
+                     tag_keys: int = 5) -> str:
+    """
+    Return the DuckDB SELECT generating `rows` rows of the given format.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format '{fmt}', expected one of {', '.join(FORMATS)}")
+    payer = f"lpad(CAST(100000000000 + {_value_sql(3, max(1, accounts // 10))} AS VARCHAR), 12, '0')"
+    account = f"lpad(CAST(100000000000 + {_value_sql(5, accounts)} AS VARCHAR), 12, '0')"
+    arn_id = _value_sql(7, arns)
+    arn = (f"'arn:aws:ec2:us-east-1:' || lpad(CAST(100000000000 + {arn_id} % {max(1, accounts)} AS VARCHAR), 12, '0') "
+           f"|| ':reservation/r-' || CAST({arn_id} AS VARCHAR)")
+    resource = f"'i-' || lpad(to_hex({_value_sql(11, resources)}), 17, '0')"
+    start = "TIMESTAMP '2024-01-01' + to_hours(CAST(i % 2160 AS BIGINT))"
+    product = f"[{', '.join(sql_string(p) for p in PRODUCTS)}][(i % {len(PRODUCTS)}) + 1]"
+    cost = f"CAST({_value_sql(13, 1000000)} AS DOUBLE) / 1000"
+    tag_values = [f"'value-' || CAST({_value_sql(17 + k, 50)} AS VARCHAR)" for k in range(tag_keys)]
+    if fmt == "cur2":
+        tags = f"map([{', '.join(sql_string(f'user:tag{k}') for k in range(tag_keys))}], [{', '.join(tag_values)}])"
+        cols = [
+            f"{payer} AS bill_payer_account_id",
+            f"{account} AS line_item_usage_account_id",
+            f"{resource} AS line_item_resource_id",
+            f"{arn} AS reservation_reservation_a_r_n",
+            f"{start} AS line_item_usage_start_date",
+            f"{product} AS line_item_product_code",
+            f"{cost} AS line_item_unblended_cost",
+            f"{tags} AS resource_tags",
+        ]
+    elif fmt == "legacy":
+        cols = [
+            f'{payer} AS "bill/PayerAccountId"',
+            f'{account} AS "lineItem/UsageAccountId"',
+            f'{resource} AS "lineItem/ResourceId"',
+            f'{arn} AS "reservation/ReservationARN"',
+            f'{start} AS "lineItem/UsageStartDate"',
+            f'{product} AS "lineItem/ProductCode"',
+            f'{cost} AS "lineItem/UnblendedCost"',
+        ] + [f'{value} AS "resourceTags/user:tag{k}"' for k, value in enumerate(tag_values)]
+    else:
+        fields = ", ".join(f"'tag{k}': {value}" for k, value in enumerate(tag_values))
+        tags = f"CAST(to_json({{{fields}}}) AS VARCHAR)" if tag_keys else "'{}'"
+        cols = [
+            f"{payer} AS BillingAccountId",
+            f"{account} AS SubAccountId",
+            f"{resource} AS ResourceId",
+            f"{start} AS ChargePeriodStart",
+            f"{product} AS ServiceName",
+            f"{cost} AS BilledCost",
+            f"{tags} AS Tags",
+        ]
+    return f"SELECT {', '.join(cols)} FROM range({int(rows)}) t(i)"
+
+
+def generate(fmt: str, output: str, rows: int, con=None, **knobs) -> str:
+    """
+    Write a synthetic file of the given format (Parquet, or CSV for a .csv output) and return its path.
+    """
+    con = con or connect()
+    options = "FORMAT CSV, HEADER 1" if output.lower().endswith(".csv") else "FORMAT PARQUET"
+    con.execute(f"COPY ({synthetic_select(fmt, rows, **knobs)}) TO {sql_string(output)} ({options})")
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic CUR2, legacy CUR or FOCUS file.")
+    parser.add_argument('--format', choices=FORMATS, required=True)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--accounts', type=int, default=100)
+    parser.add_argument('--arns', type=int, default=10000)
+    parser.add_argument('--resources', type=int, default=100000)
+    parser.add_argument('--tag-keys', type=int, default=5)
+    parser.add_argument('--output', required=True)
+    args = parser.parse_args()
+    generate(args.format, args.output, args.rows, accounts=args.accounts, arns=args.arns,
+             resources=args.resources, tag_keys=args.tag_keys)
+    print(f"Synthetic {args.format} file with {args.rows} rows written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# run.py
+# Benchmark the anonymisers on synthetic data and write a comparable JSON report.
+#
+# Usage Examples:
+#   python benchmarks/run.py --rows 1000000 --report bench_1m.json
+#   python benchmarks/run.py --format cur2 --rows 1000000 10000000 100000000 --workdir /mnt/nvme/bench --report cur2.json
+#
+# Each (format, rows) run generates its synthetic file, then times these stages separately:
+#   config        config generation from the input file (generate_config_entry)
+#   mapping:*     each mapping stage (account dictionary, each ARN and uuid column)
+#   mappings      the whole mapping build, including the column strategy estimates
+#   copy          the final anonymising COPY to Parquet
+# and reports wall time, rows per second and the run's peak RSS so far after each stage, using the
+# same Profiler as the anonymisers' --profile report.
+# Every run happens in a fresh process, so peak RSS is not inherited from earlier runs.
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'python')))
+from anonymiser_common import connect, register_input, build_mappings, plan_select, write_output, generate_config_entry, MODE_ACTIONS, Profiler
+from generate import FORMATS, COLUMNS, generate
+
+
+def run_one(fmt: str, rows: int, workdir: str, knobs: dict, uuid_strategy: str) -> dict:
+    """
+    Generate one synthetic file and time every stage of anonymising it.
+    """
+    mode = fmt
+    input_file = os.path.join(workdir, f"{fmt}_{rows}.parquet")
+    output_file = os.path.join(workdir, f"{fmt}_{rows}_anonymised.parquet")
+    config_file = os.path.join(workdir, f"{fmt}_{rows}_config.json")
+    start = time.perf_counter()
+    generate(fmt, input_file, rows, **knobs)
+    generate_seconds = time.perf_counter() - start
+
+    profiler = Profiler(None)
+    profiler.report["input_rows"] = rows
+    profiler.stage("config", lambda: generate_config_entry(input_file, config_file, mode=mode))
+    with open(config_file) as f:
+        config = json.load(f)
+    # Exercise a uuid mapping as well as the account and ARN ones
+    config["columns"][COLUMNS[fmt]["resource"]] = "uuid"
+    config["strategies"] = {COLUMNS[fmt]["resource"]: uuid_strategy}
+
+    con = connect()
+    register_input(con, "cur", [input_file])
+    mapping_tables, inline_exprs = profiler.stage(
+        "mappings", lambda: build_mappings(con, "cur", config, MODE_ACTIONS[mode], profiler=profiler)
+    )
+    select_sql = plan_select(con, "cur", config["columns"], mapping_tables, MODE_ACTIONS[mode], inline_exprs)
+    profiler.stage("copy", lambda: write_output(con, select_sql, output_file), rows=lambda written: written)
+    con.close()
+    stages = profiler.finish()["stages"]
+    return {
+        "format": fmt,
+        "rows": rows,
+        "knobs": knobs,
+        "uuid_strategy": uuid_strategy,
+        "input_bytes": os.path.getsize(input_file),
+        "generate_seconds": round(generate_seconds, 4),
+        "stages": stages,
+        "total_seconds": round(sum(s["seconds"] for s in stages if not s["name"].startswith("mapping:")), 4),
+    }
+
+
+def _run_in_child(args: tuple) -> dict:
+    """
+    Process-pool entry point: run one benchmark, keeping stdout for the report, then delete its files.
+    """
+    import contextlib
+    fmt, rows, workdir = args[:3]
+    with contextlib.redirect_stdout(sys.stderr):
+        result = run_one(*args)
+    for name in os.listdir(workdir):
+        if name.startswith(f"{fmt}_{rows}_") or name == f"{fmt}_{rows}.parquet":
+            os.remove(os.path.join(workdir, name))
+    return result
+
+
+def main():
+    import duckdb
+    import shutil
+    import tempfile
+    from concurrent.futures import ProcessPoolExecutor
+    parser = argparse.ArgumentParser(description="Benchmark the anonymisers on synthetic CUR2, legacy CUR and FOCUS data.")
+    parser.add_argument('--format', nargs='+', choices=FORMATS, default=list(FORMATS))
+    parser.add_argument('--rows', nargs='+', type=int, default=[1000000], help='Row counts to run, e.g. 1000000 10000000 100000000')
+    parser.add_argument('--accounts', type=int, default=100)
+    parser.add_argument('--arns', type=int, default=10000)
+    parser.add_argument('--resources', type=int, default=100000)
+    parser.add_argument('--tag-keys', type=int, default=5)
+    parser.add_argument('--uuid-strategy', choices=("auto", "inline", "mapping"), default="mapping")
+    parser.add_argument('--workdir', help='Directory for the generated and anonymised files (default: a temporary directory)')
+    parser.add_argument('--report', help='Write the JSON report to this file (default: stdout)')
+    args = parser.parse_args()
+
+    knobs = {"accounts": args.accounts, "arns": args.arns, "resources": args.resources, "tag_keys": args.tag_keys}
+    workdir = args.workdir or tempfile.mkdtemp(prefix="anonymiser-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    runs = []
+    for fmt in args.format:
+        for rows in args.rows:
+            # A fresh process per run, so each run's peak RSS is its own
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                run = pool.submit(_run_in_child, (fmt, rows, workdir, knobs, args.uuid_strategy)).result()
+            print(f"{fmt} {rows} rows: {run['total_seconds']}s", file=sys.stderr)
+            runs.append(run)
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "duckdb": duckdb.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "runs": runs,
+    }
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Benchmark report written to {args.report}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
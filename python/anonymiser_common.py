@@ -22,10 +22,13 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import glob
+import hashlib
 import random
 import re
 import os  # Ensure os is available for all functions
-from typing import Any, List, Optional
+import sys
+from typing import Any, List, Optional, Union
 
 class AnonymiserInputError(Exception):
     """Raised when input file validation fails for anonymiser."""
@@ -35,12 +38,62 @@ class AnonymiserInputError(Exception):
 # Core Anonymiser Logic
 # =====================
 
-def generate_fake_aws_account_id(original_id: Any) -> str:
+# Fake account ID schemes: 'md5' is evaluated by DuckDB as a vectorised expression,
+# 'random' reproduces the IDs of earlier releases (random.seed per ID) through a Python UDF.
+AWSID_SCHEMES = ("md5", "random")
+# Scheme for configs without an 'awsid_scheme' key, i.e. written by earlier releases, so their fake IDs
+# stay the same; generate_config() writes "md5" into new configs.
+DEFAULT_AWSID_SCHEME = "random"
+
+
+def generate_fake_aws_account_id(original_id: Any, scheme: str = DEFAULT_AWSID_SCHEME) -> str:
     """
     Generate a deterministic fake 12-digit AWS account ID based on the original ID.
+    Python mirror of fake_aws_account_id_sql: both return the same ID for the same input.
+    """
+    if scheme == "random":
+        return ''.join(random.Random(str(original_id)).choices('0123456789', k=12))
+    digest = hashlib.md5(str(original_id).encode("utf-8")).hexdigest()
+    return str(int(digest[:16], 16) % 1000000000000).zfill(12)
+
+
+def fake_aws_account_id_sql(expr: str, scheme: str = DEFAULT_AWSID_SCHEME) -> str:
+    """
+    Return a DuckDB SQL expression computing the fake account ID for the SQL expression `expr`.
+    The 'random' scheme needs register_awsid_scheme() to have been called on the connection.
+    """
+    if scheme not in AWSID_SCHEMES:
+        raise AnonymiserInputError(f"Unknown awsid_scheme '{scheme}', expected one of {', '.join(AWSID_SCHEMES)}.")
+    if scheme == "random":
+        return f"fake_aws_account_id_random(CAST({expr} AS VARCHAR))"
+    return (
+        f"lpad(CAST(CAST('0x' || substr(md5(CAST({expr} AS VARCHAR)), 1, 16) AS UBIGINT) "
+        f"% 1000000000000 AS VARCHAR), 12, '0')"
+    )
+
+
+def register_awsid_scheme(con: Any, scheme: str) -> None:
     """
-    random.seed(str(original_id))
-    return ''.join(random.choices('0123456789', k=12))
+    Register the Python UDF used by the 'random' scheme on the connection (no-op for 'md5').
+    """
+    if scheme != "random":
+        return
+    exists = con.execute(
+        "SELECT 1 FROM duckdb_functions() WHERE function_name = 'fake_aws_account_id_random'"
+    ).fetchall()
+    if not exists:
+        con.create_function(
+            "fake_aws_account_id_random",
+            lambda original_id: generate_fake_aws_account_id(original_id, scheme="random"),
+            ["VARCHAR"],
+            "VARCHAR",
+        )
+
+
+ARN_REGEX = re.compile(r"^arn:([^:]+):([^:]*):([^:]*):([^:]*):(.+)$")
+# The same match as ARN_REGEX for DuckDB (RE2), split around the account segment.
+# The optional trailing newline mirrors Python's '$', which also matches before a final newline.
+ARN_SQL_REGEX = r"^(arn:[^:]+:[^:]*:[^:]*:)([^:]*)(:.+)\n?$"
 
 
 def generate_fake_arn(original_arn: str, fake_account_id: str) -> str:
@@ -48,8 +101,7 @@ def generate_fake_arn(original_arn: str, fake_account_id: str) -> str:
     Generate a fake ARN by replacing the account-id part with the fake account ID, if present.
     """
     original_arn = str(original_arn)  # Ensure string type
-    arn_regex = r"^arn:([^:]+):([^:]*):([^:]*):([^:]*):(.+)$"
-    m = re.match(arn_regex, original_arn)
+    m = ARN_REGEX.match(original_arn)
     if m:
         parts = list(m.groups())
         if parts[3]:
@@ -61,57 +113,555 @@ def generate_fake_arn(original_arn: str, fake_account_id: str) -> str:
         return original_arn
 
 
-def build_awsid_mapping(con: Any, table: str, col: str) -> str:
+def fake_arn_sql(arn_expr: str, fake_account_expr: str) -> str:
+    """
+    Return a DuckDB SQL expression equivalent to generate_fake_arn(arn_expr, fake_account_expr).
+    """
+    parts = f"regexp_extract({arn_expr}, '{ARN_SQL_REGEX}', ['head', 'account', 'tail'])"
+    return (
+        f"CASE WHEN {parts}.account <> '' "
+        f"THEN {parts}.head || {fake_account_expr} || {parts}.tail "
+        f"ELSE {arn_expr} END"
+    )
+
+
+MAPPING_STORE = "mapping_store"
+
+
+def attach_mapping_store(con: Any, path: str) -> None:
+    """
+    Attach the on-disk mapping store (a DuckDB database file, created if missing) to the connection.
+    """
+    con.execute(f"ATTACH IF NOT EXISTS {sql_string(path)} AS {MAPPING_STORE}")
+
+
+def _store_mapping_table(con: Any, store_key: str) -> str:
+    """
+    Create the stored mapping table if needed and return its qualified name.
+    """
+    stored = f"{MAPPING_STORE}.{store_key}"
+    con.execute(f"CREATE TABLE IF NOT EXISTS {stored} (original TEXT PRIMARY KEY, fake TEXT)")
+    return stored
+
+
+def create_mapping_table(con: Any, mapping_table: str, source_sql: str, fake_sql: str, store_key: Optional[str] = None) -> str:
+    """
+    Create the (original, fake) mapping table from the distinct originals returned by source_sql,
+    with fake_sql evaluated over its columns (aliased src). source_sql must return each original once,
+    so a join against the mapping can never multiply rows; the stored mapping also enforces this
+    with a primary key (skipped for per-run tables, where the index costs more than the mapping).
+    If mapping_table already exists on the connection, only its missing originals are appended, so
+    queries planned against it earlier stay covered.
+    With store_key, the mapping is kept in the attached mapping store: only originals not stored yet
+    are computed and appended, and the qualified stored table is returned instead of mapping_table,
+    so other connections attaching the same store can use the returned name as is.
+    """
+    if store_key is None:
+        exists = con.execute(
+            f"SELECT 1 FROM duckdb_tables() WHERE temporary AND table_name = {sql_string(mapping_table)}"
+        ).fetchall()
+        if exists:
+            con.execute(
+                f"INSERT INTO {mapping_table} SELECT src.original, {fake_sql} AS fake FROM ({source_sql}) src "
+                f"ANTI JOIN {mapping_table} known ON src.original = known.original"
+            )
+        else:
+            con.execute(f"CREATE TEMP TABLE {mapping_table} AS SELECT src.original, {fake_sql} AS fake FROM ({source_sql}) src")
+        return mapping_table
+    stored = _store_mapping_table(con, store_key)
+    con.execute(
+        f"INSERT INTO {stored} SELECT src.original, {fake_sql} AS fake FROM ({source_sql}) src "
+        f"ANTI JOIN {stored} known ON src.original = known.original"
+    )
+    return stored
+
+
+def build_awsid_mapping(con: Any, table: str, col: str, scheme: str = DEFAULT_AWSID_SCHEME, store: bool = False) -> str:
+    """
+    Build a mapping table in DuckDB for AWS account IDs to fake IDs, in a single set-based statement.
+    """
+    register_awsid_scheme(con, scheme)
+    mapping_table = f"map_{col.replace('/', '_').replace('.', '_')}_{scheme}"
+    return create_mapping_table(
+        con,
+        mapping_table,
+        f'SELECT DISTINCT CAST("{col}" AS VARCHAR) AS original FROM {table} WHERE "{col}" IS NOT NULL',
+        fake_aws_account_id_sql("src.original", scheme),
+        mapping_table if store else None,
+    )
+
+
+def build_account_dictionary(con: Any, table: str, id_cols: List[str], arn_cols: List[str] = (), scheme: str = DEFAULT_AWSID_SCHEME, store: bool = False) -> str:
     """
-    Build a mapping table in DuckDB for AWS account IDs to fake IDs.
+    Build one account ID mapping table shared by every account ID column and the ARN rewriter.
+    The distinct IDs of all account columns and the account segments of all ARN columns
+    are collected in a single scan, so an account gets the same fake ID everywhere.
     """
-    unique_ids = con.execute(f'SELECT DISTINCT "{col}" FROM {table} WHERE "{col}" IS NOT NULL').fetchall()
-    mapping = []
-    for (orig_id,) in unique_ids:
-        fake_id = generate_fake_aws_account_id(orig_id)
-        mapping.append((orig_id, fake_id))
-    mapping_table = f"map_{col.replace('/', '_').replace('.', '_')}"
-    con.execute(f"CREATE TEMP TABLE {mapping_table} (original TEXT, fake TEXT)")
-    if mapping:
-        con.executemany(f"INSERT INTO {mapping_table} (original, fake) VALUES (?, ?)", mapping)
-    return mapping_table
+    register_awsid_scheme(con, scheme)
+    ids = [f'CAST("{col}" AS VARCHAR)' for col in id_cols]
+    ids += [f"""nullif(regexp_extract(CAST("{col}" AS VARCHAR), '{ARN_SQL_REGEX}', 2), '')""" for col in arn_cols]
+    mapping_table = f"map_awsid_{scheme}"
+    return create_mapping_table(
+        con,
+        mapping_table,
+        f"SELECT DISTINCT original FROM (SELECT unnest([{', '.join(ids)}]) AS original FROM {table}) WHERE original IS NOT NULL",
+        fake_aws_account_id_sql("src.original", scheme),
+        mapping_table if store else None,
+    )
 
 
-def build_arn_mapping(con: Any, table: str, col: str, account_col: str, account_mapping_table: str) -> str:
+def build_arn_mapping(con: Any, table: str, col: str, account_mapping_table: str, scheme: str = DEFAULT_AWSID_SCHEME, store: bool = False) -> str:
     """
     Build a mapping table in DuckDB for ARNs to fake ARNs using the fake account ID mapping.
+    The mapping is keyed on the ARN alone: the account segment embedded in each ARN is looked up
+    in the account mapping table and rewritten in SQL.
     """
-    unique_arns = con.execute(
-        f'SELECT DISTINCT cur."{col}", cur."{account_col}" FROM {table} cur WHERE cur."{col}" IS NOT NULL'
-    ).fetchall()
-    account_map = dict(con.execute(f'SELECT original, fake FROM {account_mapping_table}').fetchall())
-    mapping = []
-    for orig_arn, orig_account_id in unique_arns:
-        fake_account_id = account_map.get(str(orig_account_id), generate_fake_aws_account_id(orig_account_id))
-        fake_arn = generate_fake_arn(orig_arn, fake_account_id)
-        mapping.append((orig_arn, fake_arn))
-    mapping_table = f"map_{col.replace('/', '_').replace('.', '_')}"
-    con.execute(f"CREATE TEMP TABLE {mapping_table} (original TEXT, fake TEXT)")
-    if mapping:
-        con.executemany(f"INSERT INTO {mapping_table} (original, fake) VALUES (?, ?)", mapping)
-    return mapping_table 
+    register_awsid_scheme(con, scheme)
+    mapping_table = f"arn_map_{col.replace('/', '_').replace('.', '_')}_{scheme}"
+    account = f"regexp_extract(src.original, '{ARN_SQL_REGEX}', 2)"
+    # Accounts missing from the mapping (e.g. a dictionary built without ARN columns) are faked directly
+    fake_account = f"COALESCE(src.fake_account_id, {fake_aws_account_id_sql(account, scheme)})"
+    return create_mapping_table(
+        con,
+        mapping_table,
+        f"SELECT arns.original, acct.fake AS fake_account_id "
+        f'FROM (SELECT DISTINCT CAST("{col}" AS VARCHAR) AS original FROM {table} WHERE "{col}" IS NOT NULL) arns '
+        f"LEFT JOIN {account_mapping_table} acct "
+        f"ON regexp_extract(arns.original, '{ARN_SQL_REGEX}', 2) = acct.original",
+        fake_arn_sql("src.original", fake_account),
+        mapping_table if store else None,
+    )
+
+
+# Types whose DuckDB VARCHAR cast is identical to Python's str(), so UUID5 can be computed in SQL
+UUID5_SQL_TYPES = {
+    "VARCHAR", "DATE", "TINYINT", "SMALLINT", "INTEGER", "BIGINT", "HUGEINT",
+    "UTINYINT", "USMALLINT", "UINTEGER", "UBIGINT", "UHUGEINT",
+}
 
 
-def build_uuid_mapping(con: Any, table: str, col: str) -> str:
+def uuid5_sql(expr: str) -> str:
     """
-    Build a mapping table in DuckDB for a column, mapping each unique value to a deterministic UUID (consistent for each unique input value).
+    Return a DuckDB SQL expression equal to str(uuid.uuid5(uuid.NAMESPACE_DNS, expr)) for a VARCHAR expression.
+    """
+    import uuid
+    digest = f"sha1(unhex('{uuid.NAMESPACE_DNS.hex}') || encode({expr}))"
+    # RFC 4122: version nibble 5, variant bits 10xx
+    return (
+        f"substr({digest}, 1, 8) || '-' || substr({digest}, 9, 4) || '-5' || substr({digest}, 14, 3) || '-' "
+        f"|| substr('89ab', (CAST('0x' || substr({digest}, 17, 1) AS INTEGER) & 3) + 1, 1) "
+        f"|| substr({digest}, 18, 3) || '-' || substr({digest}, 21, 12)"
+    )
+
+
+def register_uuid5_function(con: Any, col_type: str) -> str:
+    """
+    Register a Python UUID5 UDF taking values of col_type, for types whose str() differs from DuckDB's cast.
+    Returns the function name.
     """
     import uuid
-    unique_values = con.execute(f'SELECT DISTINCT "{col}" FROM {table} WHERE "{col}" IS NOT NULL').fetchall()
-    mapping = []
-    for (orig_val,) in unique_values:
-        fake_uuid = str(uuid.uuid5(uuid.NAMESPACE_DNS, str(orig_val)))
-        mapping.append((orig_val, fake_uuid))
+    name = "uuid5_" + re.sub(r"\W+", "_", col_type.lower()).strip("_")
+    exists = con.execute(f"SELECT 1 FROM duckdb_functions() WHERE function_name = '{name}'").fetchall()
+    if not exists:
+        con.create_function(name, lambda value: str(uuid.uuid5(uuid.NAMESPACE_DNS, str(value))), [col_type], "VARCHAR")
+    return name
+
+
+def build_uuid_mapping(con: Any, table: str, col: str, store: bool = False) -> str:
+    """
+    Build a mapping table in DuckDB for a column, mapping each unique value to a deterministic UUID (consistent for each unique input value).
+    UUIDs are computed in SQL for string and integer columns, and through a Python UDF otherwise.
+    """
     mapping_table = f"uuid_map_{col.replace('/', '_').replace('.', '_')}"
-    con.execute(f"CREATE TEMP TABLE {mapping_table} (original TEXT, fake TEXT)")
-    if mapping:
-        con.executemany(f"INSERT INTO {mapping_table} (original, fake) VALUES (?, ?)", mapping)
-    return mapping_table 
+    col_type = con.execute(f'DESCRIBE SELECT "{col}" FROM {table}').fetchone()[1]
+    if col_type in UUID5_SQL_TYPES:
+        fake_sql = uuid5_sql("src.original")
+    else:
+        fake_sql = f"{register_uuid5_function(con, col_type)}(src.value)"
+    return create_mapping_table(
+        con,
+        mapping_table,
+        f'SELECT CAST(value AS VARCHAR) AS original, value FROM (SELECT DISTINCT "{col}" AS value FROM {table} WHERE "{col}" IS NOT NULL)',
+        fake_sql,
+        mapping_table if store else None,
+    )
+
+
+# Per-key rules for json_tags columns: keep the tag, keep its key and hash its value, hash both, or drop it.
+# Keys without a rule of their own follow the '*' rule, or hash_value.
+TAG_RULES = ("keep", "hash_value", "hash", "remove")
+DEFAULT_TAG_RULE = "hash_value"
+
+
+def validate_tag_rules(tag_rules: dict) -> None:
+    """
+    Raise AnonymiserInputError for any tag rule that is not one of TAG_RULES.
+    """
+    for key, rule in tag_rules.items():
+        if rule not in TAG_RULES:
+            raise AnonymiserInputError(f"Unknown tag rule '{rule}' for tag '{key}', expected one of {', '.join(TAG_RULES)}.")
+
+
+def json_tags_sql(doc: str, tag_rules: dict) -> str:
+    """
+    Return a SQL expression anonymising the JSON object text `doc` key by key, following tag_rules, and
+    re-serialising it as a JSON object. JSON null stays NULL; any other text that is not a JSON object of
+    unique keys (including an object with a duplicate key, which cannot become a MAP) is hashed whole, so
+    it never leaks and one malformed tag set cannot fail the run.
+    """
+    default = tag_rules.get("*", DEFAULT_TAG_RULE)
+    whens = " ".join(f"WHEN {sql_string(key)} THEN {sql_string(rule)}" for key, rule in tag_rules.items() if key != "*")
+    rule = f"CASE e.key {whens} ELSE {sql_string(default)} END" if whens else sql_string(default)
+    tag = (f"struct_pack(k := CASE WHEN {rule} = 'hash' THEN CAST(md5_number_upper(e.key) AS VARCHAR) ELSE e.key END, "
+           f"v := CASE WHEN {rule} = 'keep' THEN e.value ELSE CAST(md5_number_upper(e.value) AS VARCHAR) END)")
+    tags = f"map_entries(CAST(CAST({doc} AS JSON) AS MAP(VARCHAR, VARCHAR)))"
+    # Checked up front: TRY_CAST and TRY still raise "Map keys must be unique" on a duplicate key
+    unique_keys = f"len(list_distinct(json_keys({doc}))) = len(json_keys({doc}))"
+    return (f"CASE WHEN {doc} = 'null' THEN NULL "
+            f"WHEN json_valid({doc}) AND json_type({doc}) = 'OBJECT' AND {unique_keys} THEN "
+            f"CAST(to_json(map_from_entries(list_transform(list_filter({tags}, e -> {rule} <> 'remove'), e -> {tag}))) AS VARCHAR) "
+            f"ELSE CAST(md5_number_upper({doc}) AS VARCHAR) END")
+
+
+def json_tags_key_sql(col_type: str, expr: str) -> str:
+    """
+    The JSON object text a tag column is anonymised from, and its mapping joined on: MAP columns
+    (CUR2 resource_tags) are serialised with to_json, text columns are used as they are. NULL becomes
+    JSON null, so every row finds its mapping: DuckDB emits a LEFT JOIN's unmatched rows out of input order.
+    """
+    text = f"CAST(to_json({expr}) AS VARCHAR)" if col_type.startswith("MAP(") else f"CAST({expr} AS VARCHAR)"
+    return f"COALESCE({text}, 'null')"
+
+
+def build_json_tags_mapping(con: Any, table: str, col: str, tag_rules: Optional[dict] = None, store: bool = False) -> str:
+    """
+    Build the mapping from each distinct tag set of a json_tags column to its anonymised JSON. Tag sets repeat
+    heavily across rows, so each is parsed and rewritten once, in one vectorised statement; the mapping is
+    named after the rules, so it is reused (and in a mapping store, extended) only for the same rules.
+    """
+    import json
+    tag_rules = tag_rules or {}
+    validate_tag_rules(tag_rules)
+    rules_id = hashlib.md5(json.dumps(tag_rules, sort_keys=True).encode()).hexdigest()[:8]
+    mapping_table = f"tags_map_{col.replace('/', '_').replace('.', '_')}_{rules_id}"
+    col_type = con.execute(f'DESCRIBE SELECT "{col}" FROM {table}').fetchone()[1]
+    key = json_tags_key_sql(col_type, f'"{col}"')
+    return create_mapping_table(
+        con,
+        mapping_table,
+        f"SELECT DISTINCT {key} AS original FROM {table}",
+        json_tags_sql("src.original", tag_rules),
+        mapping_table if store else None,
+    )
+
+
+# Column strategies for uuid and awsarn_anonymise columns: a mapping table joined back onto the data,
+# or the deterministic replacement computed inline for every row. 'auto' picks from a cardinality estimate.
+COLUMN_STRATEGIES = ("auto", "inline", "mapping")
+INLINE_DISTINCT_RATIO = 0.5
+CARDINALITY_SAMPLE_ROWS = 100000
+
+
+def estimate_distinct_ratio(con: Any, table: str, col: str) -> float:
+    """
+    Estimate the share of distinct values in a column from its first CARDINALITY_SAMPLE_ROWS rows.
+    """
+    rows, distinct = con.execute(
+        f'SELECT count(*), approx_count_distinct(v) FROM (SELECT "{col}" AS v FROM {table} LIMIT {CARDINALITY_SAMPLE_ROWS})'
+    ).fetchone()
+    return distinct / rows if rows else 0.0
+
+
+def inline_fake_sql(con: Any, table: str, col: str, action: str, scheme: str = DEFAULT_AWSID_SCHEME) -> Optional[str]:
+    """
+    Return a per-row SQL expression computing the column's replacement without a mapping table,
+    or None when the column needs one (uuid columns whose type has no SQL UUID5 path, and ARN columns
+    under the 'random' scheme, whose Python UDF would run per row instead of per distinct value).
+    """
+    source = f'CAST({table}."{col}" AS VARCHAR)'
+    if action == "uuid":
+        col_type = con.execute(f'DESCRIBE SELECT "{col}" FROM {table}').fetchone()[1]
+        return uuid5_sql(source) if col_type in UUID5_SQL_TYPES else None
+    if action == "awsarn_anonymise" and scheme != "random":
+        account = f"regexp_extract({source}, '{ARN_SQL_REGEX}', 2)"
+        return fake_arn_sql(source, fake_aws_account_id_sql(account, scheme))
+    return None
+
+
+def choose_inline_fake_sql(con: Any, table: str, col: str, action: str, strategy: str = "auto", scheme: str = DEFAULT_AWSID_SCHEME) -> Optional[str]:
+    """
+    Apply a column strategy: return the inline expression if the column should skip its mapping table, else None.
+    'auto' inlines columns whose values are mostly distinct, where a mapping and its join cost more than the expression.
+    """
+    if strategy not in COLUMN_STRATEGIES:
+        raise AnonymiserInputError(f"Unknown strategy '{strategy}' for column '{col}', expected one of {', '.join(COLUMN_STRATEGIES)}.")
+    if strategy == "mapping":
+        return None
+    expr = inline_fake_sql(con, table, col, action, scheme)
+    if expr is None or strategy == "inline":
+        return expr
+    return expr if estimate_distinct_ratio(con, table, col) >= INLINE_DISTINCT_RATIO else None
+
+
+# Actions whose fake values come from a mapping table, and the kind of mapping
+MAPPED_ACTIONS = {"awsid_anonymise": "awsid", "awsarn_anonymise": "awsarn", "uuid": "uuid"}
+ALL_ACTIONS = ("keep", "remove", "awsid_anonymise", "awsarn_anonymise", "hash", "uuid", "json_tags")
+FOCUS_ACTIONS = ("keep", "remove", "hash", "uuid", "json_tags")
+MODE_ACTIONS = {"legacy": ALL_ACTIONS, "cur2": ALL_ACTIONS, "focus": FOCUS_ACTIONS}
+# Columns a --period-start/--period-end window applies to by default, first match in the input wins
+PERIOD_COLUMNS = {
+    "legacy": ("lineItem/UsageStartDate", "line_item_usage_start_date"),
+    "cur2": ("line_item_usage_start_date",),
+    "focus": ("ChargePeriodStart",),
+}
+# Dictionaries up to this size are inlined as a CASE expression instead of being hash-joined
+INLINE_LOOKUP_MAX_ROWS = 16
+
+
+def validate_actions(column_actions: dict, supported_actions: tuple = ALL_ACTIONS) -> None:
+    """
+    Raise AnonymiserInputError for any column whose action the anonymiser does not support.
+    """
+    for col, action in column_actions.items():
+        if action not in supported_actions:
+            raise AnonymiserInputError(f"Unsupported action '{action}' for column '{col}'.")
+
+
+def build_mappings(con: Any, table: str, config: dict, supported_actions: tuple = ALL_ACTIONS, store: bool = False,
+                   manifest: Optional["JobManifest"] = None, profiler: Optional["Profiler"] = None) -> tuple:
+    """
+    Apply the column strategies and build every mapping table the config needs over `table`.
+    With a manifest, each mapping stage is checkpointed, and stages a previous run completed are skipped.
+    With a profiler, each mapping stage is timed as 'mapping:<stage>' along with its distinct values.
+    Returns (mapping_tables, inline_exprs), ready for plan_select.
+    """
+    def stage(name, build):
+        run = (lambda: manifest.stage(name, build)) if manifest else build
+        if not profiler:
+            return run()
+        return profiler.stage(f"mapping:{name}", run, distinct=lambda mt: con.execute(f"SELECT count(*) FROM {mt}").fetchone()[0])
+    column_actions = config["columns"]
+    validate_actions(column_actions, supported_actions)
+    scheme = config.get("awsid_scheme", DEFAULT_AWSID_SCHEME)
+    strategies = config.get("strategies", {})
+    awsid_cols = [col for col, action in column_actions.items() if action == "awsid_anonymise"]
+    arn_cols = [col for col, action in column_actions.items() if action == "awsarn_anonymise"]
+    uuid_cols = [col for col, action in column_actions.items() if action == "uuid"]
+    tag_cols = [col for col, action in column_actions.items() if action == "json_tags"]
+
+    inline_exprs = {}
+    for col in arn_cols + uuid_cols:
+        expr = choose_inline_fake_sql(con, table, col, column_actions[col], strategies.get(col, "auto"), scheme)
+        if expr:
+            inline_exprs[col] = expr
+    mapped_arn_cols = [col for col in arn_cols if col not in inline_exprs]
+
+    mapping_tables = {}
+    if awsid_cols or mapped_arn_cols:
+        account_mapping_table = stage("awsid", lambda: build_account_dictionary(con, table, awsid_cols, mapped_arn_cols, scheme, store=store))
+        for col in awsid_cols:
+            mapping_tables[col] = account_mapping_table
+        for col in mapped_arn_cols:
+            mapping_tables[col] = stage(f"awsarn:{col}", lambda: build_arn_mapping(con, table, col, account_mapping_table, scheme, store=store))
+    for col in uuid_cols:
+        if col not in inline_exprs:
+            mapping_tables[col] = stage(f"uuid:{col}", lambda: build_uuid_mapping(con, table, col, store=store))
+    for col in tag_cols:
+        mapping_tables[col] = stage(f"json_tags:{col}", lambda: build_json_tags_mapping(con, table, col, config.get("tag_rules"), store=store))
+    return mapping_tables, inline_exprs
+
+
+def plan_select(con: Any, table: str, column_actions: dict, mapping_tables: dict, supported_actions: tuple = ALL_ACTIONS,
+                inline_exprs: Optional[dict] = None) -> str:
+    """
+    Build the anonymising SELECT over `table`.
+    Each mapped column is looked up in its own mapping table (the account ID columns share the one account
+    dictionary); small mapping tables are inlined as a CASE expression, larger ones are hash-joined.
+    Columns in inline_exprs are replaced by their per-row expression, with no mapping or join.
+    """
+    inline_exprs = inline_exprs or {}
+    validate_actions(column_actions, supported_actions)
+    inline = {}
+    for col, action in column_actions.items():
+        mt = mapping_tables.get(col)
+        if action in MAPPED_ACTIONS and col not in inline_exprs and mt not in inline:
+            rows = con.execute(f"SELECT original, fake FROM {mt} LIMIT {INLINE_LOOKUP_MAX_ROWS + 1}").fetchall()
+            inline[mt] = rows if len(rows) <= INLINE_LOOKUP_MAX_ROWS else None
+    select_cols = []
+    join_clauses = []
+    for col, action in column_actions.items():
+        source = f'CAST({table}."{col}" AS VARCHAR)'
+        if col in inline_exprs:
+            select_cols.append(f'COALESCE({inline_exprs[col]}, {source}) AS "{col}"')
+        elif action in MAPPED_ACTIONS:
+            mt = mapping_tables[col]
+            if inline[mt] is not None:
+                whens = " ".join(f"WHEN {sql_string(o)} THEN {sql_string(f)}" for o, f in inline[mt])
+                fake = f"CASE {source} {whens} END" if whens else "NULL"
+            else:
+                alias = f"j{len(join_clauses)}"
+                join_clauses.append(f"LEFT JOIN {mt} {alias} ON {source} = {alias}.original")
+                fake = f"{alias}.fake"
+            select_cols.append(f'COALESCE({fake}, {source}) AS "{col}"')
+        elif action == "json_tags":
+            # Joined on the tag set's JSON text; MAP columns get a MAP back
+            col_type = con.execute(f'DESCRIBE SELECT "{col}" FROM {table}').fetchone()[1]
+            alias = f"j{len(join_clauses)}"
+            key = json_tags_key_sql(col_type, f'{table}."{col}"')
+            join_clauses.append(f"LEFT JOIN {mapping_tables[col]} {alias} ON {key} = {alias}.original")
+            fake = f"CAST(CAST({alias}.fake AS JSON) AS MAP(VARCHAR, VARCHAR))" if col_type.startswith("MAP(") else f"{alias}.fake"
+            select_cols.append(f'{fake} AS "{col}"')
+        elif action == "hash":
+            select_cols.append(f'md5_number_upper({source}) AS "{col}"')
+        elif action == "keep":
+            select_cols.append(f'{table}."{col}"')
+    return f"SELECT {', '.join(select_cols)} FROM {table} " + " ".join(join_clauses)
+
+
+# Pre-flight planning (--plan): one scan gathers per-column statistics, from which each mapped column's
+# strategy, the mapping memory and a rough run time are estimated. The cost model is deliberately simple;
+# --profile measures the real stages.
+PLAN_ENTRY_OVERHEAD_BYTES = 64  # per mapping entry: row storage, string headers and the join's hash table slot
+PLAN_FAKE_BYTES = {"awsid_anonymise": 12, "uuid": 36}
+PLAN_SCAN_BYTES_PER_SECOND = 200 * 1000 ** 2  # per thread
+# Mapping entries built per second and thread; json_tags rewrites every tag set, so it is much slower
+PLAN_MAPPING_ENTRIES_PER_SECOND = {"json_tags": 100 * 1000}
+PLAN_DEFAULT_MAPPING_ENTRIES_PER_SECOND = 2 * 1000 ** 2
+ACCOUNT_ID_SQL_REGEX = r"^\d{12}$"
+
+
+def column_statistics(con: Any, table: str, columns: List[str], checks: Optional[dict] = None) -> dict:
+    """
+    Gather, in a single scan, the row count and for each column its approximate distinct count (HyperLogLog),
+    null ratio and average width in bytes. checks maps a column to a regex its non-null values should match;
+    the share that does not is returned as 'mismatch_ratio'. Returns {"rows": n, "columns": {col: stats}}.
+    """
+    checks = checks or {}
+    aggregates = ["count(*)"]
+    for col in columns:
+        text = f'CAST("{col}" AS VARCHAR)'
+        aggregates += [f'approx_count_distinct("{col}")', f'count("{col}")', f"avg(strlen({text}))"]
+        if col in checks:
+            aggregates.append(f"count_if(NOT regexp_matches({text}, {sql_string(checks[col])}))")
+    values = list(con.execute(f"SELECT {', '.join(aggregates)} FROM {table}").fetchone())
+    rows = values.pop(0)
+    stats = {}
+    for col in columns:
+        distinct, non_null, width = values.pop(0), values.pop(0), values.pop(0)
+        stats[col] = {"distinct": distinct, "null_ratio": round(1 - non_null / rows, 4) if rows else 0.0,
+                      "avg_bytes": round(width or 0.0, 1)}
+        if col in checks:
+            mismatches = values.pop(0)
+            stats[col]["mismatch_ratio"] = round(mismatches / non_null, 4) if non_null else 0.0
+    return {"rows": rows, "columns": stats}
+
+
+def memory_bytes(value: Optional[str]) -> Optional[int]:
+    """
+    Parse a DuckDB memory size such as '8GB' or '12.5 GiB' into bytes, or None if it cannot be parsed.
+    """
+    m = MEMORY_LIMIT_REGEX.match(value or "")
+    return int(float(m.group(1)) * MEMORY_UNITS[(m.group(2) or "B").lower()]) if m else None
+
+
+def plan_columns(con: Any, table: str, config: dict, supported_actions: tuple = ALL_ACTIONS,
+                 source_columns: Optional[List[str]] = None) -> dict:
+    """
+    The pre-flight plan: gather the column statistics in one scan, pick each mapped column's strategy
+    (as 'auto' would, but from the whole column rather than a sample), and estimate the memory held by
+    mapping tables and the run time. Returns the plan; nothing is built.
+    source_columns are the input's columns before the config's projection (default: those of `table`);
+    configured columns missing from them are warned about.
+    """
+    column_actions = config["columns"]
+    validate_actions(column_actions, supported_actions)
+    scheme = config.get("awsid_scheme", DEFAULT_AWSID_SCHEME)
+    strategies = config.get("strategies", {})
+    # Matched case-insensitively, as DuckDB resolves column names
+    projected = {row[1].lower() for row in con.execute(f"PRAGMA table_info({table})").fetchall()}
+    present = {col.lower() for col in source_columns} if source_columns is not None else projected
+    columns = [col for col, action in column_actions.items() if action != "remove" and col.lower() in projected]
+    checks = {col: ACCOUNT_ID_SQL_REGEX for col in columns if column_actions[col] == "awsid_anonymise"}
+    checks.update({col: ARN_SQL_REGEX for col in columns if column_actions[col] == "awsarn_anonymise"})
+    statistics = column_statistics(con, table, columns, checks)
+    rows = statistics["rows"]
+    threads = con.execute("SELECT current_setting('threads')").fetchone()[0]
+    memory_limit = con.execute("SELECT current_setting('memory_limit')").fetchone()[0]
+    plan = {"rows": rows, "threads": threads, "memory_limit": memory_limit, "columns": {}, "warnings": [
+        f"Column '{col}' is in the config but not in the input." for col in column_actions if col.lower() not in present]}
+    mapping_bytes = mapping_seconds = 0
+    for col in columns:
+        action = column_actions[col]
+        entry = {"action": action, **statistics["columns"][col]}
+        non_null = rows * (1 - entry["null_ratio"])
+        if action in MAPPED_ACTIONS or action == "json_tags":
+            strategy = strategies.get(col, "auto")
+            if strategy not in COLUMN_STRATEGIES:
+                raise AnonymiserInputError(f"Unknown strategy '{strategy}' for column '{col}', expected one of {', '.join(COLUMN_STRATEGIES)}.")
+            inline_possible = action in ("awsarn_anonymise", "uuid") and inline_fake_sql(con, table, col, action, scheme) is not None
+            if strategy == "auto":
+                strategy = "inline" if inline_possible and non_null and entry["distinct"] / non_null >= INLINE_DISTINCT_RATIO else "mapping"
+            elif strategy == "inline" and not inline_possible:
+                strategy = "mapping"
+            entry["strategy"] = strategy
+            entry["mapping_bytes"] = 0
+            if strategy == "mapping":
+                fake_bytes = PLAN_FAKE_BYTES.get(action, entry["avg_bytes"])
+                entry["mapping_bytes"] = int(entry["distinct"] * (entry["avg_bytes"] + fake_bytes + PLAN_ENTRY_OVERHEAD_BYTES))
+                mapping_bytes += entry["mapping_bytes"]
+                mapping_seconds += entry["distinct"] / PLAN_MAPPING_ENTRIES_PER_SECOND.get(action, PLAN_DEFAULT_MAPPING_ENTRIES_PER_SECOND)
+        mismatch = entry.get("mismatch_ratio")
+        if mismatch:
+            expected = "12-digit account IDs" if action == "awsid_anonymise" else "ARNs"
+            plan["warnings"].append(f"Column '{col}' is set to {action}, but {mismatch:.1%} of its values are not "
+                                    f"{expected}; is it free text? They are passed through unchanged.")
+        plan["columns"][col] = entry
+    scan_bytes = rows * sum(entry["avg_bytes"] for entry in plan["columns"].values())
+    mapping_scans = 1 + sum(1 for entry in plan["columns"].values() if entry.get("strategy") == "mapping")
+    plan["estimated_mapping_bytes"] = mapping_bytes
+    plan["estimated_seconds"] = round((scan_bytes * mapping_scans / PLAN_SCAN_BYTES_PER_SECOND + mapping_seconds) / threads, 1)
+    limit = memory_bytes(memory_limit)
+    plan["fits_memory_limit"] = limit is None or mapping_bytes <= limit
+    return plan
+
+
+def format_bytes(size: float) -> str:
+    """
+    Format a byte count for humans, e.g. '1.5 GiB'.
+    """
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
+
+def format_plan(plan: dict) -> str:
+    """
+    Render a pre-flight plan as the table --plan prints.
+    """
+    lines = [f"{'column':<40} {'action':<17} {'distinct':>12} {'nulls':>6} {'bytes':>7} {'strategy':<8} {'mapping':>10}"]
+    for col, entry in plan["columns"].items():
+        mapping = format_bytes(entry["mapping_bytes"]) if entry.get("strategy") == "mapping" else ""
+        lines.append(f"{col:<40} {entry['action']:<17} {entry['distinct']:>12} {entry['null_ratio']:>6.1%} "
+                     f"{entry['avg_bytes']:>7} {entry.get('strategy', ''):<8} {mapping:>10}")
+    lines.append(f"Rows: {plan['rows']}, threads: {plan['threads']}")
+    lines.append(f"Estimated mapping memory: {format_bytes(plan['estimated_mapping_bytes'])} "
+                 f"(memory limit {plan['memory_limit']})")
+    lines.append(f"Estimated time: ~{plan['estimated_seconds']}s (rough; measure with --profile)")
+    lines += [f"Warning: {warning}" for warning in plan["warnings"]]
+    return "\n".join(lines)
+
+
+def apply_plan(config: dict, plan: dict) -> dict:
+    """
+    Return a copy of config whose 'auto' columns use the strategies the plan picked.
+    """
+    strategies = dict(config.get("strategies", {}))
+    for col, entry in plan["columns"].items():
+        if entry["action"] in ("awsarn_anonymise", "uuid") and strategies.get(col, "auto") == "auto":
+            strategies[col] = entry["strategy"]
+    return {**config, "strategies": strategies}
 
 
 def generate_config(columns: List[str], mode: str = "legacy") -> dict:
@@ -119,22 +669,30 @@ def generate_config(columns: List[str], mode: str = "legacy") -> dict:
     Generate a config dict for anonymisation. Never assign 'uuid' by default.
     mode: 'legacy', 'cur2', or 'focus' (affects AWS-specific logic)
     """
-    focus_hash_cols = {"BillingAccountId", "BillingAccountName", "SubAccountId", "SubAccountIdName", "InvoiceId", "tag"}
+    focus_hash_cols = {"BillingAccountId", "BillingAccountName", "SubAccountId", "SubAccountIdName", "InvoiceId"}
+    focus_tag_cols = {"tag", "Tags"}
     config = {
         "_comment": (
             "Column options: 'keep' (keep as is), 'remove' (remove column), "
             "'awsid_anonymise' (anonymise as AWS account ID), "
             "'awsarn_anonymise' (anonymise as AWS ARN using fake account ID), "
             "'hash' (hash the column using DuckDB's md5_number_upper), "
-            "'uuid' (replace with consistent UUID, only if explicitly set)"
+            "'uuid' (replace with consistent UUID, only if explicitly set), "
+            "'json_tags' (keep tag keys, hash tag values, following 'tag_rules'). "
+            "'awsid_scheme': 'md5' or 'random' (used when the key is missing) to reproduce account IDs from earlier releases. "
+            "'tag_rules': per tag key 'keep', 'hash_value', 'hash' or 'remove'; '*' applies to every other key"
         ),
         "columns": {}
     }
+    if mode in ("legacy", "cur2"):
+        config["awsid_scheme"] = "md5"
     for col in columns:
         col_lower = col.lower()
         if mode in ("legacy", "cur2"):
             if "account_id" in col_lower or "usageaccountid" in col_lower or "payeraccountid" in col_lower:
                 config["columns"][col] = "awsid_anonymise"
+            elif mode == "cur2" and col_lower == "resource_tags":
+                config["columns"][col] = "json_tags"
             elif "resourcetags" in col_lower or "resource_tags" in col_lower:
                 config["columns"][col] = "hash"
             elif "a_r_n" in col_lower or "arn" in col_lower:
@@ -144,9 +702,13 @@ def generate_config(columns: List[str], mode: str = "legacy") -> dict:
         elif mode == "focus":
             if col in focus_hash_cols:
                 config["columns"][col] = "hash"
+            elif col in focus_tag_cols:
+                config["columns"][col] = "json_tags"
             else:
                 config["columns"][col] = "keep"
-    return config 
+    if "json_tags" in config["columns"].values():
+        config["tag_rules"] = {"*": DEFAULT_TAG_RULE}
+    return config
 
 # =====================
 # Shared CLI and File Utilities
@@ -162,10 +724,32 @@ def parse_args(description: str, epilog: str):
         formatter_class=argparse.RawDescriptionHelpFormatter,
         epilog=epilog
     )
-    parser.add_argument('--input', required=False, help='Input file (CSV or Parquet)')
-    parser.add_argument('--output', required=False, help='Output file (CSV or Parquet)')
+    parser.add_argument('--input', required=False, nargs='+', help="Input file(s) (CSV or Parquet): paths, globs or directories, all anonymised together; '-' reads an Arrow IPC stream from stdin")
+    parser.add_argument('--output', required=False, help="Output file (CSV or Parquet); '-' writes an Arrow IPC stream to stdout")
     parser.add_argument('--config', required=False, help='JSON config file for column handling')
-    parser.add_argument('--create-config', action='store_true', help='Create a config file from the input file')
+    parser.add_argument('--create-config', action='store_true', help='Create a config file from the input files (Parquet footers), or add their new columns to an existing one')
+    parser.add_argument('--where', help="Anonymise only the input rows matching this DuckDB predicate, e.g. \"line_item_product_code = 'AmazonEC2'\"")
+    parser.add_argument('--period-start', help='Anonymise only the rows whose period column is at or after this date or timestamp')
+    parser.add_argument('--period-end', help='Anonymise only the rows whose period column is before this date or timestamp')
+    parser.add_argument('--period-column', help='Column --period-start/--period-end apply to (default: the usage start date column of the mode)')
+    parser.add_argument('--partition-by', nargs='+', help="Write a hive-partitioned output directory; columns or month(<column>) expressions")
+    parser.add_argument('--row-group-size', type=int, help='Rows per Parquet row group in the output')
+    parser.add_argument('--compression', help='Output compression codec, e.g. zstd, snappy, gzip, uncompressed')
+    parser.add_argument('--per-thread-output', action='store_true', help='Write one output file per DuckDB thread into the output directory')
+    parser.add_argument('--overwrite', action='store_true', help='Replace an existing non-empty output directory (with --partition-by or --per-thread-output)')
+    parser.add_argument('--mapping-store', required=False, help='DuckDB database file keeping the mappings between runs; only new values are anonymised and appended')
+    parser.add_argument('--jobs', type=int, default=1, help='Anonymise several input files in this many processes, one output part per input file in the --output directory')
+    parser.add_argument('--resume', action='store_true', help='Checkpoint the run in a manifest next to the output and skip mapping stages and parts an earlier run finished')
+    parser.add_argument('--threads', type=int, help='DuckDB worker threads (default: one per CPU core)')
+    parser.add_argument('--memory-limit', help="DuckDB memory limit, e.g. '8GB'; larger work spills to the temp directory")
+    parser.add_argument('--temp-dir', help='Directory for DuckDB spill files, ideally on fast local storage')
+    parser.add_argument('--no-preserve-insertion-order', action='store_true', help='Let DuckDB write rows out of input order so the output is streamed without buffering')
+    parser.add_argument('--profile', help='Write a JSON report of each stage: wall time, rows or distinct values, and peak memory')
+    parser.add_argument('--profile-query', action='store_true', help="Add DuckDB's profile of the final query (EXPLAIN ANALYZE tree) to the --profile report")
+    parser.add_argument('--materialise', action='store_true', help='Load the whole input into a DuckDB table first instead of streaming it from the file')
+    parser.add_argument('--plan', action='store_true', help='Scan the input once for per-column statistics, print the strategy, memory and time estimates for each column, and exit')
+    parser.add_argument('--preflight', action='store_true', help='Run the --plan pass first, fail fast if the mappings would not fit the memory limit, then anonymise with the planned strategies')
+    parser.add_argument('--batch', help="Run the JSON job lines of this file ('-' for stdin) in one process and DuckDB connection, answering each with a JSON result line")
     parser.add_argument('--version', action='version', version='anonymiser 1.0')
     return parser.parse_args()
 
@@ -178,30 +762,1220 @@ def validate_input_file(input_file: str) -> None:
     if size == 0:
         raise AnonymiserInputError("Input file is empty (0 bytes).")
 
-def generate_config_entry(input_file: str, config_file: Optional[str] = None, mode: str = "legacy") -> None:
+INPUT_EXTENSIONS = (".parquet", ".csv", ".csv.gz")
+
+def input_format(input_file: str) -> str:
+    """
+    Return 'csv' or 'parquet' for an input or output path, based on its extension (.csv.gz is gzipped CSV).
+    """
+    return "csv" if input_file.lower().endswith((".csv", ".csv.gz")) else "parquet"
+
+def resolve_input_files(inputs: Union[str, List[str]]) -> List[str]:
+    """
+    Expand input paths, globs and directories into a sorted list of files.
+    Directories are searched recursively for CSV and Parquet files.
+    Raises AnonymiserInputError if nothing matches or CSV and Parquet files are mixed.
+    """
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    files = []
+    for entry in inputs:
+        if os.path.isdir(entry):
+            matches = [
+                os.path.join(root, name)
+                for root, _, names in os.walk(entry)
+                for name in names
+                if name.lower().endswith(INPUT_EXTENSIONS)
+            ]
+        elif glob.has_magic(entry):
+            matches = [path for path in glob.glob(entry, recursive=True) if os.path.isfile(path)]
+        else:
+            if not os.path.isfile(entry):
+                raise AnonymiserInputError(f"Input file not found: {entry}")
+            matches = [entry]
+        if not matches:
+            raise AnonymiserInputError(f"No input files found for {entry}")
+        files.extend(sorted(matches))
+    files = list(dict.fromkeys(files))
+    if len({input_format(f) for f in files}) > 1:
+        raise AnonymiserInputError("Input files mix CSV and Parquet; anonymise each format separately.")
+    return files
+
+def sql_string(value: str) -> str:
+    """
+    Quote a Python string as a DuckDB string literal.
+    """
+    return "'" + value.replace("'", "''") + "'"
+
+def sql_identifier(name: str) -> str:
+    """
+    Quote a Python string as a DuckDB identifier.
+    """
+    return '"' + name.replace('"', '""') + '"'
+
+def input_reader_sql(input_files: Union[str, List[str]], csv_schema: Optional[dict] = None) -> str:
+    """
+    Return the DuckDB table function call that scans the input file(s) (CSV or Parquet).
+    Several files are read in one scan, with columns matched by name across parts.
+    CSV files are sniffed by read_csv_auto, unless a csv_schema (see sniff_csv_schema) gives the dialect
+    and column types: they are then read by read_csv with no sniffing, in parallel.
+    """
+    if isinstance(input_files, str):
+        input_files = [input_files]
+    if len(input_files) == 1:
+        files = sql_string(input_files[0])
+    else:
+        files = "[" + ", ".join(sql_string(f) for f in input_files) + "]"
+    if input_format(input_files[0]) == "csv" and csv_schema:
+        options = [f"{key}={'true' if value is True else 'false' if value is False else sql_string(str(value))}"
+                   for key, value in csv_schema.items() if key in CSV_DIALECT_OPTIONS]
+        columns = ", ".join(f"{sql_string(col)}: {sql_string(col_type)}" for col, col_type in csv_schema["columns"].items())
+        return f"read_csv({files}, columns={{{columns}}}, {', '.join(options + ['auto_detect=false', 'parallel=true'])})"
+    reader = "read_csv_auto" if input_format(input_files[0]) == "csv" else "read_parquet"
+    if len(input_files) == 1:
+        return f"{reader}({files})"
+    return f"{reader}({files}, union_by_name=true)"
+
+# =====================
+# CSV schema cache
+# =====================
+
+# read_csv options kept in a config's "csv_schema", with the sniff_csv() columns they come from
+CSV_DIALECT_OPTIONS = {
+    "delim": "Delimiter",
+    "quote": "Quote",
+    "escape": "Escape",
+    "new_line": "NewLineDelimiter",
+    "skip": "SkipRows",
+    "header": "HasHeader",
+    "dateformat": "DateFormat",
+    "timestampformat": "TimestampFormat",
+}
+
+def sniff_csv_schema(con: Any, input_files: List[str]) -> dict:
+    """
+    Sniff the dialect of the first CSV input file and the column types across all of them, once, for the
+    config's "csv_schema". Runs with that config read the files with these explicit settings instead of
+    sniffing them again; a mis-inferred type can be corrected there by hand.
+    """
+    row = con.execute(f"SELECT {', '.join(CSV_DIALECT_OPTIONS.values())} FROM sniff_csv({sql_string(input_files[0])})").fetchone()
+    schema = {}
+    for key, value in zip(CSV_DIALECT_OPTIONS, row):
+        if value is not None:
+            schema[key] = "" if value == "(empty)" else value
+    described = con.execute(f"DESCRIBE SELECT * FROM {input_reader_sql(input_files)}").fetchall()
+    schema["columns"] = {col: col_type for col, col_type, *_ in described}
+    return schema
+
+def csv_header(path: str, csv_schema: dict) -> List[str]:
+    """
+    Return the column names in the header line of a CSV (or gzipped CSV) file, parsed with the schema's dialect.
+    """
+    import csv
+    import gzip
+    opener = gzip.open if path.lower().endswith(".gz") else open
+    with opener(path, "rt", newline="", encoding="utf-8-sig", errors="replace") as f:
+        for _ in range(int(csv_schema.get("skip", 0))):
+            f.readline()
+        return next(csv.reader(f, delimiter=csv_schema.get("delim") or ",", quotechar=csv_schema.get("quote") or '"'), [])
+
+def cached_csv_schema(input_files: List[str], config: Optional[dict]) -> Optional[dict]:
+    """
+    Return the config's csv_schema if every CSV input file still has its layout, or None to sniff instead.
+    Only the header lines are read: explicit columns are matched by position, so a file whose header
+    differs would be misread.
+    """
+    csv_schema = (config or {}).get("csv_schema")
+    if not csv_schema or input_format(input_files[0]) != "csv":
+        return None
+    if csv_schema.get("header", True):
+        for input_file in input_files:
+            if csv_header(input_file, csv_schema) != list(csv_schema["columns"]):
+                print(f"The header of {input_file} does not match the config's csv_schema, so the CSV input is sniffed; "
+                      f"re-run --create-config to refresh it", file=sys.stderr)
+                return None
+    return csv_schema
+
+# =====================
+# Parquet footers
+# =====================
+
+PARQUET_MAGIC = b"PAR1"
+
+class ThriftCompactReader:
+    """
+    Minimal reader for the Thrift compact protocol Parquet footers are encoded in. Structs are read
+    into {field id: value} dicts; nothing is interpreted beyond what the caller looks up.
+    """
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.pos = 0
+
+    def byte(self) -> int:
+        self.pos += 1
+        return self.data[self.pos - 1]
+
+    def varint(self) -> int:
+        result = shift = 0
+        while True:
+            b = self.byte()
+            result |= (b & 0x7F) << shift
+            if not b & 0x80:
+                return result
+            shift += 7
+
+    def zigzag(self) -> int:
+        n = self.varint()
+        return (n >> 1) ^ -(n & 1)
+
+    def value(self, kind: int) -> Any:
+        if kind in (1, 2):
+            # Booleans are encoded in the field type; inside lists they are one byte each
+            return kind == 1
+        if kind == 3:
+            return self.byte()
+        if kind in (4, 5, 6):
+            return self.zigzag()
+        if kind == 7:
+            self.pos += 8
+            return None
+        if kind == 8:
+            size = self.varint()
+            self.pos += size
+            return self.data[self.pos - size:self.pos]
+        if kind in (9, 10):
+            header = self.byte()
+            size = header >> 4 if header >> 4 != 15 else self.varint()
+            item = header & 0x0F
+            return [self.byte() == 1 if item in (1, 2) else self.value(item) for _ in range(size)]
+        if kind == 11:
+            size = self.varint()
+            types = self.byte() if size else 0
+            return {self.value(types >> 4): self.value(types & 0x0F) for _ in range(size)}
+        if kind == 12:
+            return self.struct()
+        raise ValueError(f"unknown Thrift compact type {kind}")
+
+    def struct(self, stop_after: Optional[int] = None) -> dict:
+        """
+        Read a struct. With stop_after, reading ends once that field id has been read, skipping the rest.
+        """
+        fields = {}
+        field_id = 0
+        while True:
+            header = self.byte()
+            if header == 0:
+                return fields
+            delta, kind = header >> 4, header & 0x0F
+            field_id = field_id + delta if delta else self.zigzag()
+            fields[field_id] = self.value(kind)
+            if stop_after is not None and field_id >= stop_after:
+                return fields
+
+def parquet_footer_columns(path: str) -> tuple:
+    """
+    Read the top-level column names and row count of a Parquet file from its footer alone: the
+    FileMetaData at the end of the file is decoded without DuckDB, and the row groups are not read.
+    Returns (columns, num_rows). Raises AnonymiserInputError for empty or non-Parquet files.
+    """
+    import struct
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size < 12:
+            raise AnonymiserInputError(f"Input file is empty or not a Parquet file: {path}")
+        f.seek(size - 8)
+        tail = f.read(8)
+        if tail[4:] != PARQUET_MAGIC:
+            raise AnonymiserInputError(f"Not a Parquet file, or its footer is encrypted: {path}")
+        footer_size = struct.unpack("<I", tail[:4])[0]
+        if footer_size > size - 12:
+            raise AnonymiserInputError(f"Corrupt Parquet footer: {path}")
+        f.seek(size - 8 - footer_size)
+        footer = f.read(footer_size)
+    try:
+        # FileMetaData: 2 = schema (flattened depth first), 3 = num_rows, 4 = row_groups (not needed)
+        metadata = ThriftCompactReader(footer).struct(stop_after=3)
+    except (IndexError, ValueError) as e:
+        raise AnonymiserInputError(f"Corrupt Parquet footer: {path} ({e})")
+    schema = metadata.get(2) or []
+    columns = []
+
+    def skip(i: int) -> int:
+        # SchemaElement: 4 = name, 5 = num_children; nested fields follow their parent
+        end = i + 1
+        for _ in range(schema[i].get(5) or 0):
+            end = skip(end)
+        return end
+
+    i = 1
+    while i < len(schema):
+        columns.append(schema[i][4].decode("utf-8"))
+        i = skip(i)
+    return columns, metadata.get(3, 0)
+
+def parquet_schemas(input_files: List[str]) -> dict:
+    """
+    Read the footer columns of many Parquet files in parallel threads. Returns {file: columns} in input order.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor() as pool:
+        return dict(zip(input_files, (columns for columns, _ in pool.map(parquet_footer_columns, input_files))))
+
+def parquet_row_count(input_files: List[str]) -> int:
+    """
+    Sum the row counts of many Parquet files from their footers, read in parallel threads, without a scan.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor() as pool:
+        return sum(rows for _, rows in pool.map(parquet_footer_columns, input_files))
+
+def hive_partition_keys(input_files: List[str]) -> List[str]:
+    """
+    The hive partition columns (key=value directories) DuckDB adds when reading these files: only when
+    every file's path has the same keys, as with DuckDB's own auto-detection.
+    """
+    keys = None
+    for input_file in input_files:
+        parts = os.path.normpath(os.path.dirname(input_file)).split(os.sep)
+        file_keys = [part.split("=", 1)[0] for part in parts if "=" in part]
+        if keys is not None and file_keys != keys:
+            return []
+        keys = file_keys
+    return keys or []
+
+def union_columns(schemas: dict) -> tuple:
+    """
+    Union the columns of several files, in order of first appearance, followed by any hive partition
+    columns. Returns (columns, drift), where drift maps each column missing from some files to the files
+    it appears in.
+    """
+    present = {}
+    for input_file, columns in schemas.items():
+        for col in columns:
+            present.setdefault(col, []).append(input_file)
+    drift = {col: files for col, files in present.items() if len(files) < len(schemas)}
+    hive = [key for key in hive_partition_keys(list(schemas)) if key not in present]
+    return list(present) + hive, drift
+
+MEMORY_LIMIT_REGEX = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(B|KB|MB|GB|TB|KiB|MiB|GiB|TiB)?\s*$", re.IGNORECASE)
+MEMORY_UNITS = {"b": 1, "kb": 1000, "mb": 1000 ** 2, "gb": 1000 ** 3, "tb": 1000 ** 4,
+                "kib": 1024, "mib": 1024 ** 2, "gib": 1024 ** 3, "tib": 1024 ** 4}
+
+def resource_options(args: Any) -> dict:
+    """
+    Collect the DuckDB resource settings given on the command line, for connect().
+    """
+    return {
+        "threads": args.threads,
+        "memory_limit": args.memory_limit,
+        "temp_dir": args.temp_dir,
+        "preserve_insertion_order": not args.no_preserve_insertion_order,
+    }
+
+def split_resources(resources: dict, parts: int) -> dict:
+    """
+    Share the thread count and memory limit evenly between `parts` worker processes.
+    Memory limits that cannot be parsed (e.g. percentages) are passed to every worker unchanged.
+    """
+    resources = dict(resources)
+    resources["threads"] = max(1, (resources.get("threads") or os.cpu_count() or 1) // parts)
+    total = memory_bytes(resources.get("memory_limit"))
+    if total is not None:
+        resources["memory_limit"] = f"{total // parts}B"
+    return resources
+
+def connect(threads: Optional[int] = None, memory_limit: Optional[str] = None, temp_dir: Optional[str] = None,
+            preserve_insertion_order: bool = True) -> Any:
+    """
+    Open an in-memory DuckDB connection with the given resource controls; unset ones keep DuckDB's defaults.
+    temp_dir is where DuckDB spills data that does not fit in memory_limit. Without preserve_insertion_order
+    DuckDB may write rows out of input order, which lets the COPY stream instead of buffering.
+    """
+    import duckdb
+    config = {}
+    if threads:
+        config["threads"] = int(threads)
+    if memory_limit:
+        config["memory_limit"] = memory_limit
+    if temp_dir:
+        config["temp_directory"] = temp_dir
+    if not preserve_insertion_order:
+        config["preserve_insertion_order"] = False
+    try:
+        return duckdb.connect(config=config)
+    except duckdb.Error as e:
+        raise AnonymiserInputError(f"Invalid DuckDB resource setting: {e}")
+
+def needed_columns(column_actions: Optional[dict], available: List[str]) -> List[str]:
+    """
+    Return the columns of `available` the config needs: those configured with an action other than 'remove'.
+    Removed and unconfigured columns never reach the output. Names match case-insensitively, as in DuckDB.
+    Without a config (or if it needs none of the columns), every column is kept.
+    """
+    if not column_actions:
+        return list(available)
+    actions = {col.lower(): action for col, action in column_actions.items()}
+    needed = [col for col in available if actions.get(col.lower(), "remove") != "remove"]
+    return needed or list(available)
+
+def row_filter_sql(con: Any, config: dict, schema: List[tuple], period_columns: tuple = ()) -> Optional[str]:
+    """
+    Return the predicate selecting the input rows to anonymise, or None to keep them all.
+    config["where"] is a DuckDB predicate over the input columns; config["period"] = {"start", "end", "column"}
+    keeps the rows whose period column is in [start, end). The column defaults to the first of period_columns
+    the input has. Each bound is cast to the column's own type, so the comparison stays on the bare column
+    and DuckDB can skip the Parquet row groups whose min/max statistics fall outside the window.
+    """
+    import duckdb
+    predicates = [f"({config['where']})"] if config.get("where") else []
+    period = config.get("period") or {}
+    if period.get("start") or period.get("end"):
+        types = {name.lower(): (name, col_type) for name, col_type in schema}
+        candidates = [period["column"]] if period.get("column") else list(period_columns)
+        found = next((types[col.lower()] for col in candidates if col.lower() in types), None)
+        if found is None:
+            raise AnonymiserInputError(f"The input has no period column ({', '.join(candidates) or 'none configured'}); "
+                                       "name it with --period-column.")
+        column, col_type = sql_identifier(found[0]), found[1]
+        if not col_type.startswith(("DATE", "TIMESTAMP")):
+            column, col_type = f"TRY_CAST({column} AS TIMESTAMP)", "TIMESTAMP"
+        for key, operator in (("start", ">="), ("end", "<")):
+            if period.get(key):
+                bound = f"CAST({sql_string(str(period[key]))} AS {col_type})"
+                try:
+                    con.execute(f"SELECT {bound}")
+                except duckdb.Error:
+                    raise AnonymiserInputError(f"Invalid period {key} '{period[key]}': expected a date or timestamp.")
+                predicates.append(f"{column} {operator} {bound}")
+    return " AND ".join(predicates) or None
+
+def with_row_filter(config: dict, where: Optional[str] = None, period_start: Optional[str] = None,
+                    period_end: Optional[str] = None, period_column: Optional[str] = None) -> dict:
     """
-    Generate a config file for the input file and mode. Raises AnonymiserInputError if file is empty or has no columns.
+    Return a copy of config with a command-line row filter added (see row_filter_sql): `where` is ANDed
+    with the config's own, and the period options override the config's "period" entries.
+    """
+    if period_column and not (period_start or period_end):
+        raise AnonymiserInputError("--period-column needs --period-start or --period-end.")
+    config = dict(config)
+    if where:
+        config["where"] = f"({config['where']}) AND ({where})" if config.get("where") else where
+    period = {key: value for key, value in (("start", period_start), ("end", period_end), ("column", period_column)) if value}
+    if period:
+        config["period"] = {**config.get("period", {}), **period}
+    return config
+
+def source_schema(con: Any, source: str) -> List[tuple]:
+    """
+    Return the (column, type) pairs of `source` (a table function call or a name), without scanning it.
+    """
+    return [row[:2] for row in con.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()]
+
+def source_select_sql(con: Any, source: str, config: Optional[dict] = None, period_columns: tuple = (),
+                      schema: Optional[List[tuple]] = None) -> str:
+    """
+    Return the SELECT every anonymiser scan reads `source` (a table function call or a name) through.
+    It projects only the needed_columns() and keeps only the rows of row_filter_sql(), so the mapping-build
+    DISTINCT passes, the pre-flight statistics and the final projection never see removed columns or
+    filtered rows: Parquet projection and filter pushdown skip them in the scan, and a materialised source
+    does not store them. schema is the source_schema(), if already known.
     """
     import duckdb
+    config = config or {}
+    schema = schema or source_schema(con, source)
+    select_list = ", ".join(sql_identifier(col) for col in needed_columns(config.get("columns"), [n for n, _ in schema]))
+    sql = f"SELECT {select_list} FROM {source}"
+    row_filter = row_filter_sql(con, config, schema, period_columns)
+    if row_filter:
+        sql += f" WHERE {row_filter}"
+        try:
+            con.execute(f"DESCRIBE {sql}")
+        except duckdb.Error as e:
+            raise AnonymiserInputError(f"Invalid row filter '{row_filter}': {e}")
+    return sql
+
+def register_input(con: Any, table: str, input_files: Union[str, List[str]], materialise: bool = False,
+                   config: Optional[dict] = None, period_columns: tuple = (),
+                   schema: Optional[List[tuple]] = None) -> List[str]:
+    """
+    Expose the input file(s) to DuckDB under the name `table`, and return the input's column names.
+    By default this is a view, so the mapping builders and the final COPY stream from the files
+    and peak memory depends on the mapping sizes rather than the row count.
+    With materialise=True the files are copied into an in-memory table first.
+    Given the config, only the columns and rows it needs are exposed (see source_select_sql), and CSV
+    files are read with its cached csv_schema when they still match it.
+    Given a schema ((column, type) pairs, e.g. the union of every part of a parallel run), the files are
+    read as that schema: each column is cast to its type, and a column the files lack reads as NULLs.
+    """
+    if isinstance(input_files, str):
+        input_files = [input_files]
+    reader = input_reader_sql(input_files, cached_csv_schema(input_files, config))
+    if schema is not None:
+        types = {col.lower(): col_type for col, col_type in source_schema(con, reader)}
+        columns = ", ".join(
+            sql_identifier(col) if types.get(col.lower()) == col_type
+            else f"CAST({sql_identifier(col) if col.lower() in types else 'NULL'} AS {col_type}) AS {sql_identifier(col)}"
+            for col, col_type in schema
+        )
+        reader = f"(SELECT {columns} FROM {reader})"
+    schema = source_schema(con, reader)
+    kind = "TABLE" if materialise else "VIEW"
+    con.execute(f"CREATE {kind} {table} AS {source_select_sql(con, reader, config, period_columns, schema)}")
+    return [col for col, _ in schema]
+
+PARTITION_MONTH_REGEX = re.compile(r"^month\((.+)\)$", re.IGNORECASE)
+
+def partition_columns(partition_by: List[str]) -> List[tuple]:
+    """
+    Turn --partition-by entries into (partition column, SQL expression) pairs.
+    'month(col)' partitions on a derived '<col>_month' column formatted as YYYY-MM.
+    """
+    columns = []
+    for entry in partition_by:
+        m = PARTITION_MONTH_REGEX.match(entry.strip())
+        if m:
+            col = m.group(1).strip().strip('"')
+            # ISO strings that DuckDB cannot cast (e.g. '2024-06-12T00:00Z') still start with YYYY-MM
+            month = f"COALESCE(strftime(TRY_CAST(\"{col}\" AS TIMESTAMP), '%Y-%m'), substr(CAST(\"{col}\" AS VARCHAR), 1, 7))"
+            columns.append((f"{col}_month", month))
+        else:
+            columns.append((entry, None))
+    return columns
+
+def _remove_path(path: str) -> None:
+    """
+    Remove a file or directory tree if it exists.
+    """
+    import shutil
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+def write_output(con: Any, select_sql: str, output_file: str, partition_by: Optional[List[str]] = None,
+                 row_group_size: Optional[int] = None, compression: Optional[str] = None,
+                 per_thread_output: bool = False, overwrite: bool = False) -> int:
+    """
+    COPY the anonymised query to the output file (CSV, gzipped CSV or Parquet, chosen by extension) and return the rows written.
+    With partition_by or per_thread_output, output_file is a directory written by several threads in parallel.
+    An existing non-empty directory there is only replaced with overwrite. Raises AnonymiserInputError if
+    the output cannot be written.
+    """
+    import duckdb
+    output_file = os.path.normpath(output_file)
+    is_csv = input_format(output_file) == "csv"
+    options = ["FORMAT CSV, HEADER 1" if is_csv else "FORMAT PARQUET"]
+    if partition_by:
+        partitions = partition_columns(partition_by)
+        derived = [f'{expr} AS "{name}"' for name, expr in partitions if expr]
+        if derived:
+            select_sql = f"SELECT *, {', '.join(derived)} FROM ({select_sql})"
+        options.append("PARTITION_BY (" + ", ".join(f'"{name}"' for name, _ in partitions) + ")")
+    if per_thread_output:
+        options.append("PER_THREAD_OUTPUT true")
+    if row_group_size:
+        if is_csv:
+            raise AnonymiserInputError("--row-group-size only applies to Parquet output.")
+        options.append(f"ROW_GROUP_SIZE {int(row_group_size)}")
+    if compression:
+        options.append(f"COMPRESSION {sql_string(compression)}")
+    kind = "directory" if partition_by or per_thread_output else "file"
+    if kind == "directory" and not overwrite and (os.path.isfile(output_file) or
+                                                  (os.path.isdir(output_file) and os.listdir(output_file))):
+        raise AnonymiserInputError(f"Output {output_file} already exists and is not an empty directory; "
+                                   "use --overwrite to replace it.")
+    # Write next to the target and rename into place, so an interrupted run never leaves a partial output
+    temp_output = os.path.join(os.path.dirname(output_file), f".tmp-{os.path.basename(output_file)}")
+    _remove_path(temp_output)
+    try:
+        rows = con.execute(f"COPY ({select_sql}) TO {sql_string(temp_output)} ({', '.join(options)})").fetchone()[0]
+        if kind == "directory":
+            _remove_path(output_file)
+        os.replace(temp_output, output_file)
+    except (duckdb.IOException, duckdb.PermissionException, OSError) as e:
+        _remove_path(temp_output)
+        raise AnonymiserInputError(f"Could not write the output {output_file}: {e}")
+    print(f"Anonymised {kind} written to {output_file} ({'CSV' if is_csv else 'Parquet'} format)")
+    return rows
+
+class JobManifest:
+    """
+    Checkpoint of a --resume run, kept as JSON next to the output: the mapping stages built into the
+    mapping store and the output parts written so far. It is rewritten atomically after every step,
+    so a run killed at any point leaves a manifest listing only finished work.
+    """
+
+    def __init__(self, path: str, config: dict, input_files: List[str], mapping_store: str):
+        import json
+        self.path = path
+        self.data = {
+            "config": config,
+            "inputs": [os.path.abspath(f) for f in input_files],
+            "mapping_store": os.path.abspath(mapping_store),
+            "stages": {},
+            "parts": {},
+        }
+        if os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            for key in ("config", "inputs", "mapping_store"):
+                if saved.get(key) != self.data[key]:
+                    raise AnonymiserInputError(
+                        f"{path} was written for a different {key.replace('_', ' ')}; remove it to start the run over."
+                    )
+            # Completed stages live in the store; without it they must be rebuilt
+            if not os.path.exists(mapping_store):
+                saved["stages"] = {}
+            self.data = saved
+        self.save()
+
+    def save(self) -> None:
+        import json
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(temp_path, self.path)
+
+    def stage(self, name: str, build) -> str:
+        """
+        Return the mapping table of a completed stage, or run build() and record its result.
+        """
+        if name not in self.data["stages"]:
+            self.data["stages"][name] = build()
+            self.save()
+        return self.data["stages"][name]
+
+    def part_done(self, key: str) -> bool:
+        return key in self.data["parts"]
+
+    def complete_part(self, key: str, output: str) -> None:
+        self.data["parts"][key] = output
+        self.save()
+
+def peak_rss_mb() -> Optional[float]:
+    """
+    Peak resident set size of this process so far, in MiB, or None where the resource module is unavailable.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+class Profiler:
+    """
+    Per-stage instrumentation for --profile: wall time, rows, distinct values (for mapping stages)
+    and peak memory of each stage, saved as a JSON report. With query_profile, DuckDB's profile of the
+    final query (its EXPLAIN ANALYZE operator tree, timings and peak buffer memory) is captured as well,
+    from the run itself rather than by executing the query a second time.
+    """
+
+    def __init__(self, path: Optional[str], query_profile: bool = False):
+        self.path = path
+        self.query_profile = query_profile
+        self.report = {"input_rows": None, "output_rows": None, "stages": []}
+
+    def stage(self, name: str, build, rows=None, distinct=None, profile_con: Any = None) -> Any:
+        """
+        Run build() as a named stage and return its result. rows and distinct are counts, or functions of the result.
+        With profile_con, DuckDB's profile of the queries build() runs on that connection is captured.
+        """
+        import json
+        import tempfile
+        import time
+        capture = self.query_profile and profile_con is not None
+        if capture:
+            fd, profile_path = tempfile.mkstemp(suffix=".json")
+            os.close(fd)
+            profile_con.execute("SET enable_profiling = 'json'")
+            profile_con.execute(f"SET profiling_output = {sql_string(profile_path)}")
+        start = time.perf_counter()
+        try:
+            result = build()
+        finally:
+            seconds = time.perf_counter() - start
+            if capture:
+                profile_con.execute("RESET enable_profiling")
+        entry = {"name": name, "seconds": round(seconds, 4), "rows": rows(result) if callable(rows) else rows}
+        if distinct is not None:
+            entry["distinct"] = distinct(result) if callable(distinct) else distinct
+        entry["peak_rss_mb"] = peak_rss_mb()
+        if capture:
+            with open(profile_path) as f:
+                entry["query_profile"] = json.load(f)
+            os.remove(profile_path)
+        self.report["stages"].append(entry)
+        return result
+
+    def finish(self, status: str = "ok") -> dict:
+        """
+        Complete the report with the run status, environment and each stage's throughput, and return it.
+        """
+        import platform
+        import duckdb
+        self.report["status"] = status
+        self.report["environment"] = {"python": platform.python_version(), "duckdb": duckdb.__version__,
+                                      "platform": platform.platform(), "cpu_count": os.cpu_count()}
+        rows = self.report["input_rows"] or self.report["output_rows"]
+        for entry in self.report["stages"]:
+            entry["rows_per_second"] = round(rows / entry["seconds"]) if rows and entry["seconds"] else None
+        return self.report
+
+    def save(self, status: str = "ok") -> None:
+        import json
+        self.finish(status)
+        with open(self.path, "w") as f:
+            json.dump(self.report, f, indent=2)
+        print(f"Profile written to {self.path}", file=sys.stderr)
+
+def part_output_path(input_file: str, input_root: str, output_dir: str) -> str:
+    """
+    Return where one input part is written in parallel mode: its path relative to input_root, under output_dir.
+    Keeping the relative path (e.g. BILLING_PERIOD=2024-06/part-0.parquet) keeps same-named parts apart.
+    """
+    return os.path.join(output_dir, os.path.relpath(os.path.abspath(input_file), input_root))
+
+def anonymise_part(task: dict) -> str:
+    """
+    Process-pool worker: anonymise one input part against mappings already built in the mapping store.
+    Each worker has its own connection and attaches the store read-only, so parts never contend for it.
+    The anonymising SELECT was planned once by the parent, so a part does no work on the store beyond its joins;
+    the part is read as the parent's schema, so columns other parts added or dropped still bind.
+    Returns the output path.
+    """
+    resources = dict(task["resources"])
+    if resources.get("temp_dir"):
+        # Workers spill into their own directories so their temporary files never collide
+        resources["temp_dir"] = os.path.join(resources["temp_dir"], f"worker-{os.getpid()}")
+    con = connect(**resources)
+    register_input(con, task["table"], [task["input"]], config=task["config"], period_columns=task["period_columns"],
+                   schema=task["schema"])
+    con.execute(f"ATTACH {sql_string(task['mapping_store'])} AS {MAPPING_STORE} (READ_ONLY)")
+    register_awsid_scheme(con, task["awsid_scheme"])
+    os.makedirs(os.path.dirname(task["output"]) or ".", exist_ok=True)
+    write_output(con, task["select_sql"], task["output"], **task["output_options"])
+    con.close()
+    return task["output"]
+
+def anonymise_parts(input_files: List[str], output_dir: str, table: str, config: dict, mapping_store: str,
+                    select_sql: str, jobs: int, manifest: Optional[JobManifest] = None,
+                    resources: Optional[dict] = None, period_columns: tuple = (),
+                    schema: Optional[List[tuple]] = None, **output_options) -> List[str]:
+    """
+    Anonymise every input part into its own output file under output_dir, running `jobs` worker processes.
+    The mappings must already be built over all parts into mapping_store, and detached from the building
+    connection, so every part gets the same fake values. select_sql is the anonymising SELECT planned over
+    `table` against those mappings; every worker runs it unchanged over its part, read as `schema` (the
+    source_schema() of all parts together, see register_input).
+    DuckDB threads and memory are split between the workers.
+    Each part is read through the config's column projection and row filter, as in register_input().
+    Parts the manifest lists as complete are skipped, and each finished part is recorded in it.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    input_root = os.path.commonpath([os.path.dirname(os.path.abspath(f)) for f in input_files])
+    worker_resources = split_resources(resources or {}, jobs)
+    tasks = [
+        {
+            "input": input_file,
+            "output": part_output_path(input_file, input_root, output_dir),
+            "table": table,
+            "config": config,
+            "period_columns": period_columns,
+            "schema": schema,
+            "awsid_scheme": config.get("awsid_scheme", DEFAULT_AWSID_SCHEME),
+            "mapping_store": mapping_store,
+            "select_sql": select_sql,
+            "resources": worker_resources,
+            "output_options": output_options,
+        }
+        for input_file in input_files
+        if not (manifest and manifest.part_done(input_file))
+    ]
+    if len(tasks) < len(input_files):
+        print(f"Resuming: {len(input_files) - len(tasks)} of {len(input_files)} parts already anonymised")
+    outputs = []
+    # Spawned rather than forked: the parent has already run DuckDB's thread pool
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {pool.submit(anonymise_part, task): task for task in tasks}
+        for future in as_completed(futures):
+            outputs.append(future.result())
+            if manifest:
+                manifest.complete_part(futures[future]["input"], outputs[-1])
+    print(f"Anonymised {len(outputs)} parts into {output_dir} using {jobs} processes")
+    return outputs
+
+def require_pyarrow() -> Any:
+    """
+    Import pyarrow, an optional dependency needed only for Arrow input and output.
+    """
+    try:
+        import pyarrow
+        import pyarrow.ipc
+    except ImportError:
+        raise AnonymiserInputError("Arrow input and output need pyarrow: pip install pyarrow")
+    return pyarrow
+
+class Anonymiser:
+    """
+    In-process anonymisation engine: the library API behind the command-line anonymisers.
+
+    A source is a path (or a list of paths, globs and directories), a DuckDB relation on the engine's
+    connection, or any Python object DuckDB can scan: Arrow tables, record batch readers, pandas
+    DataFrames. anonymise() returns a lazy DuckDB relation, so the result can be chained into more SQL,
+    fetched, or written without an intermediate file. Mappings accumulate on the connection (or in the
+    mapping store), so every source anonymised by one engine gets the same fake values.
+
+        engine = Anonymiser(config, mode="cur2")
+        relation = engine.anonymise("rawcur2.parquet")
+        reader = engine.record_batches(arrow_table)
+    """
+
+    def __init__(self, config: dict, mode: str = "cur2", con: Any = None, mapping_store: Optional[str] = None,
+                 resources: Optional[dict] = None, profiler: Optional[Profiler] = None):
+        if mode not in MODE_ACTIONS:
+            raise AnonymiserInputError(f"Unknown mode '{mode}', expected one of {', '.join(MODE_ACTIONS)}.")
+        self.config = config
+        self.supported_actions = MODE_ACTIONS[mode]
+        self.period_columns = PERIOD_COLUMNS[mode]
+        validate_actions(config["columns"], self.supported_actions)
+        self.con = con if con is not None else connect(**(resources or {}))
+        self.mapping_store = mapping_store
+        if mapping_store:
+            attach_mapping_store(self.con, mapping_store)
+        self.profiler = profiler
+        self._sources = 0
+        # Column names of each registered source before the config's projection
+        self._source_columns = {}
+        self._streams = {}
+
+    def _stage(self, name: str, build, **kwargs) -> Any:
+        return self.profiler.stage(name, build, **kwargs) if self.profiler else build()
+
+    def register(self, source: Any, materialise: bool = False) -> str:
+        """
+        Expose a source on the connection under a new name, and return the name.
+        Every kind of source is read through source_select_sql(), so only the columns and rows the config
+        needs are exposed; in-process sources are first registered under <name>_scan.
+        """
+        # Skip names taken by another engine sharing the connection
+        taken = "SELECT 1 FROM duckdb_tables() WHERE table_name = $1 UNION ALL SELECT 1 FROM duckdb_views() WHERE view_name = $1"
+        name = None
+        while name is None or self.con.execute(taken, [name]).fetchone():
+            self._sources += 1
+            name = f"anonymiser_source_{self._sources}"
+        scan = f"{name}_scan"
+        if isinstance(source, (str, list, tuple)):
+            input_files = resolve_input_files(source if isinstance(source, str) else list(source))
+            for input_file in input_files:
+                validate_input_file(input_file)
+            if self.profiler and input_format(input_files[0]) == "parquet":
+                # From the footers: profiling must not add a scan to the run it measures
+                self.profiler.report["input_rows"] = parquet_row_count(input_files)
+            self._source_columns[name] = register_input(self.con, name, input_files, materialise=materialise,
+                                                        config=self.config, period_columns=self.period_columns)
+            return name
+        if hasattr(source, "create_view"):
+            # A DuckDB relation; it must belong to this engine's connection
+            source.create_view(scan)
+        elif hasattr(source, "read_next_batch"):
+            # An Arrow record batch reader is consumed by the first query that binds it. Plan against an
+            # empty table of the same schema; the reader then streams straight into the final query, unless
+            # building the mappings has to read the rows too, in which case it is loaded into a table first
+            pa = require_pyarrow()
+            self.con.register(scan, pa.Table.from_batches([], source.schema))
+            self._source_columns[name] = source.schema.names
+            self.con.execute(f"CREATE VIEW {name} AS {source_select_sql(self.con, scan, self.config, self.period_columns)}")
+            if not (materialise or self._mappings_scan_data(name)):
+                self._streams[name] = source
+                return name
+            self.release(name)
+            self.con.register(scan, source)
+            materialise = True
+        else:
+            self.con.register(scan, source)
+        schema = source_schema(self.con, scan)
+        self._source_columns[name] = [col for col, _ in schema]
+        kind = "TEMP TABLE" if materialise else "VIEW"
+        self.con.execute(f"CREATE {kind} {name} AS {source_select_sql(self.con, scan, self.config, self.period_columns, schema)}")
+        if materialise:
+            self._drop(scan)
+        return name
+
+    def plan(self, source: Any, materialise: bool = False) -> dict:
+        """
+        Register a source and return its pre-flight plan (see plan_columns); no mapping is built.
+        """
+        table = self._stage("register", lambda: self.register(source, materialise=materialise))
+        if table in self._streams:
+            raise AnonymiserInputError("A pre-flight plan needs to scan the input, so it cannot plan a one-shot Arrow stream.")
+        plan = self._stage("preflight", lambda: plan_columns(self.con, table, self.config, self.supported_actions,
+                                                             source_columns=self._source_columns.get(table)))
+        self.release(table)
+        return plan
+
+    def _mappings_scan_data(self, table: str) -> bool:
+        """
+        Whether build_mappings() reads the rows of `table` (and not only its schema).
+        Account ID and json_tags columns always need their mapping; ARN and uuid columns do unless computed inline.
+        """
+        scheme = self.config.get("awsid_scheme", DEFAULT_AWSID_SCHEME)
+        strategies = self.config.get("strategies", {})
+        for col, action in self.config["columns"].items():
+            if action in ("awsid_anonymise", "json_tags"):
+                return True
+            if action in MAPPED_ACTIONS and (strategies.get(col, "auto") != "inline"
+                                             or inline_fake_sql(self.con, table, col, action, scheme) is None):
+                return True
+        return False
+
+    def prepare(self, source: Any, manifest: Optional[JobManifest] = None, materialise: bool = False) -> tuple:
+        """
+        Register a source and build the mappings it needs. Returns (table, mapping_tables, inline_exprs).
+        """
+        table = self._stage("register", lambda: self.register(source, materialise=materialise))
+        if not self.con.execute(f"PRAGMA table_info({table})").fetchall():
+            raise AnonymiserInputError("Input file has no columns (empty or header-only).")
+        # Header-only files (zero rows) are allowed; do not error.
+        mapping_tables, inline_exprs = self._stage("mappings", lambda: build_mappings(
+            self.con, table, self.config, self.supported_actions, store=bool(self.mapping_store),
+            manifest=manifest, profiler=self.profiler))
+        return table, mapping_tables, inline_exprs
+
+    def _plan(self, source: Any, manifest: Optional[JobManifest] = None, materialise: bool = False) -> tuple:
+        table, mapping_tables, inline_exprs = self.prepare(source, manifest, materialise)
+        select_sql = self._stage("plan", lambda: plan_select(self.con, table, self.config["columns"], mapping_tables,
+                                                             self.supported_actions, inline_exprs))
+        if table in self._streams:
+            self.con.unregister(f"{table}_scan")
+            self.con.register(f"{table}_scan", self._streams.pop(table))
+        return table, select_sql
+
+    def select_sql(self, source: Any, manifest: Optional[JobManifest] = None, materialise: bool = False) -> str:
+        """
+        Return the anonymising SELECT for a source, building its mappings first.
+        """
+        return self._plan(source, manifest, materialise)[1]
+
+    def release(self, table: str) -> None:
+        """
+        Drop a registered source from the connection, so a long-lived engine does not accumulate them.
+        """
+        self._streams.pop(table, None)
+        self._source_columns.pop(table, None)
+        self._drop(table)
+        self._drop(f"{table}_scan")
+
+    def _drop(self, name: str) -> None:
+        if self.con.execute("SELECT 1 FROM duckdb_tables() WHERE table_name = ?", [name]).fetchone():
+            self.con.execute(f"DROP TABLE {name}")
+        elif self.con.execute("SELECT 1 FROM duckdb_views() WHERE view_name = ?", [name]).fetchone():
+            self.con.execute(f"DROP VIEW {name}")
+
+    def anonymise(self, source: Any) -> Any:
+        """
+        Anonymise a source and return the result as a lazy DuckDB relation.
+        """
+        return self.con.sql(self.select_sql(source))
+
+    def record_batches(self, source: Any, rows_per_batch: int = 1000000) -> Any:
+        """
+        Anonymise a source and stream the result as a pyarrow RecordBatchReader.
+        """
+        require_pyarrow()
+        relation = self.anonymise(source)
+        # Newer DuckDB releases renamed fetch_record_batch() to to_arrow_reader()
+        to_reader = getattr(relation, "to_arrow_reader", None) or relation.fetch_record_batch
+        return to_reader(rows_per_batch)
+
+    def write(self, source: Any, output_file: str, manifest: Optional[JobManifest] = None, materialise: bool = False,
+              **output_options) -> int:
+        """
+        Anonymise a source into an output file or directory and return the rows written; see write_output() for the options.
+        The source is released once written.
+        """
+        table, select_sql = self._plan(source, manifest, materialise)
+        try:
+            rows = self._stage("copy", lambda: write_output(self.con, select_sql, output_file, **output_options),
+                               rows=lambda written: written, profile_con=self.con)
+        finally:
+            self.release(table)
+        if self.profiler:
+            self.profiler.report["output_rows"] = rows
+            if self.profiler.report["input_rows"] is None and not (self.config.get("where") or self.config.get("period")):
+                # Without a row filter every input row is written, so the COPY counted them
+                self.profiler.report["input_rows"] = rows
+        return rows
+
+def anonymise_inputs(input_files: List[str], output: str, config: dict, mode: str = "cur2",
+                     mapping_store: Optional[str] = None, materialise: bool = False, jobs: int = 1,
+                     resume: bool = False, resources: Optional[dict] = None, profiler: Optional[Profiler] = None,
+                     **output_options) -> None:
+    """
+    Anonymise the input files into output, as one query over all of them.
+    With jobs > 1 and several input files, the mappings are built once over all the files and each file
+    is then anonymised in its own process into the output directory, one output part per input part.
+    Without a mapping store, parallel runs keep the shared mappings in a temporary store.
+    With resume, the run is checkpointed in a manifest next to the output (and the mapping store defaults
+    to a file beside it), and mapping stages and output parts finished by an earlier run are skipped.
+    Both sit beside the output, never inside an output directory, which is written (or replaced) whole.
+    resources are the connect() settings, shared between the workers in parallel runs.
+    With a profiler, every stage is timed and the report is saved when the run ends, even if it fails.
+    """
+    import shutil
+    import tempfile
+    parallel = jobs > 1 and len(input_files) > 1
+    # 'out/' names the directory out, whose job files are then .out.anonymiser-* beside it
+    output = os.path.normpath(output)
+    temp_dir = None
+    manifest = None
+    if resume:
+        job_dir, prefix = os.path.dirname(output) or ".", f".{os.path.basename(output)}.anonymiser"
+        os.makedirs(job_dir, exist_ok=True)
+        mapping_store = mapping_store or os.path.join(job_dir, f"{prefix}-mappings.duckdb")
+        manifest = JobManifest(os.path.join(job_dir, f"{prefix}-manifest.json"), config, input_files, mapping_store)
+        if not parallel and manifest.part_done(output):
+            print(f"Resuming: {output} was already anonymised")
+            return
+    elif parallel and not mapping_store:
+        temp_dir = tempfile.mkdtemp(prefix="anonymiser-")
+        mapping_store = os.path.join(temp_dir, "mappings.duckdb")
+    resources = resources or {}
+    status = "failed"
+    try:
+        engine = Anonymiser(config, mode, con=connect(**resources), mapping_store=mapping_store, profiler=profiler)
+        if not parallel:
+            engine.write(input_files, output, manifest, materialise, **output_options)
+            if manifest:
+                manifest.complete_part(output, output)
+        else:
+            table, select_sql = engine._plan(input_files, manifest)
+            # Parts can lack columns other parts have (schema drift between months); the workers read
+            # every part as the union, which the SELECT was planned against
+            schema = source_schema(engine.con, input_reader_sql(input_files, cached_csv_schema(input_files, config)))
+            engine.con.close()
+            engine._stage("parts", lambda: anonymise_parts(
+                input_files, output, table, config, mapping_store, select_sql, jobs, manifest=manifest,
+                resources=resources, period_columns=engine.period_columns, schema=schema, **output_options), rows=len)
+        status = "ok"
+    finally:
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        if profiler:
+            profiler.save(status)
+
+def anonymise_arrow_ipc(inputs: List[str], output: str, config: dict, mode: str = "cur2",
+                       mapping_store: Optional[str] = None, resources: Optional[dict] = None,
+                       profiler: Optional[Profiler] = None, **output_options) -> None:
+    """
+    Anonymise through Arrow IPC streams: an input of '-' reads a stream from stdin, and an output of '-'
+    writes the anonymised batches to stdout as they are produced, so no file touches the disk.
+    """
+    pa = require_pyarrow()
+    engine = Anonymiser(config, mode, mapping_store=mapping_store, resources=resources, profiler=profiler)
+    source = pa.ipc.open_stream(sys.stdin.buffer) if inputs == ["-"] else inputs
+    status = "failed"
+    try:
+        if output != "-":
+            engine.write(source, output, **output_options)
+        else:
+            def stream() -> int:
+                reader = engine.record_batches(source)
+                rows = 0
+                with pa.ipc.new_stream(sys.stdout.buffer, reader.schema) as writer:
+                    for batch in reader:
+                        writer.write_batch(batch)
+                        rows += batch.num_rows
+                return rows
+            rows = engine._stage("stream", stream, rows=lambda written: written)
+            if profiler:
+                profiler.report["output_rows"] = rows
+        status = "ok"
+    finally:
+        if profiler:
+            profiler.save(status)
+
+def anonymise_batch(jobs: Any, mode: str = "cur2", config_file: Optional[str] = None,
+                    mapping_store: Optional[str] = None, materialise: bool = False, resources: Optional[dict] = None,
+                    results: Any = None, **output_options) -> int:
+    """
+    Run many jobs in this process on one DuckDB connection, so start-up is paid once rather than per file.
+    jobs yields JSON lines, each {"input": ..., "output": ..., "config": ...} (config defaults to config_file),
+    or {"input": ..., "create_config": <path>} to generate a config. Each job is answered with a JSON line
+    on results (default stdout) as soon as it finishes; a failed job is reported and the next one runs.
+    Engines are kept per config, and mappings live on the shared connection, so every job sharing a
+    config (or the mapping store) gets the same fake values. Returns the number of failed jobs.
+    """
+    import contextlib
     import json
-    size = os.path.getsize(input_file)
-    con = duckdb.connect()
-    ext = os.path.splitext(input_file)[1].lower()
-    if ext == ".csv":
-        df = con.execute(f"SELECT * FROM read_csv_auto('{input_file}') LIMIT 0").fetchdf()
-        columns = list(df.columns)
-        # If file is 0 bytes or only column is 'column0' and file is 0 bytes, treat as empty
-        if size == 0 or (columns == ['column0'] and size == 0):
+    import time
+    results = results or sys.stdout
+    con = connect(**(resources or {}))
+    engines = {}
+    failed = 0
+    for line in jobs:
+        if not line.strip():
+            continue
+        start = time.perf_counter()
+        result = {}
+        try:
+            job = json.loads(line)
+            if not isinstance(job, dict) or not job.get("input"):
+                raise AnonymiserInputError("Each batch job needs an 'input'.")
+            result = {key: job[key] for key in ("input", "output", "create_config") if key in job}
+            # Job messages go to stderr; stdout carries one result line per job
+            with contextlib.redirect_stdout(sys.stderr):
+                if job.get("create_config"):
+                    generate_config_entry(job["input"], job["create_config"], mode=mode, con=con)
+                else:
+                    config_path = job.get("config", config_file)
+                    if not config_path or not job.get("output"):
+                        raise AnonymiserInputError("Each batch job needs an 'output', and a 'config' unless --config is given.")
+                    if config_path not in engines:
+                        with open(config_path) as f:
+                            engines[config_path] = Anonymiser(json.load(f), mode, con=con, mapping_store=mapping_store)
+                    result["rows"] = engines[config_path].write(job["input"], job["output"], materialise=materialise,
+                                                                **output_options)
+            result["status"] = "ok"
+        except Exception as e:
+            # AnonymiserInputError, a bad job line, or a DuckDB error on one file: report it and keep serving
+            failed += 1
+            result.update(status="failed", error=str(e))
+        result["seconds"] = round(time.perf_counter() - start, 4)
+        print(json.dumps(result), file=results, flush=True)
+    con.close()
+    return failed
+
+def cli_main(mode: str, description: str, help_text: str) -> None:
+    """
+    Command-line entry point shared by the anonymiser scripts.
+    """
+    import json
+    try:
+        args = parse_args(description, help_text)
+
+        if args.create_config:
+            if not args.input:
+                print("Error: --input is required for --create-config", file=sys.stderr)
+                sys.exit(1)
+            generate_config_entry(args.input, args.config, mode=mode, resources=resource_options(args))
+            sys.exit(0)
+
+        if args.batch:
+            if args.input or args.output or args.jobs > 1 or args.resume or args.profile:
+                raise AnonymiserInputError("--batch takes its inputs and outputs from the job lines; "
+                                           "--input, --output, --jobs, --resume and --profile do not apply.")
+            if args.where or args.period_start or args.period_end:
+                raise AnonymiserInputError("--batch jobs take their row filter from their config ('where' and 'period').")
+            jobs = sys.stdin if args.batch == "-" else open(args.batch)
+            with jobs:
+                failed = anonymise_batch(jobs, mode, config_file=args.config, mapping_store=args.mapping_store,
+                                         materialise=args.materialise, resources=resource_options(args),
+                                         partition_by=args.partition_by, row_group_size=args.row_group_size,
+                                         compression=args.compression, per_thread_output=args.per_thread_output,
+                                         overwrite=args.overwrite)
+            sys.exit(1 if failed else 0)
+
+        if not args.config or not args.input or not (args.output or args.plan):
+            print("Error: --input, --config and --output are required unless --create-config is used (--plan needs no --output).\n", file=sys.stderr)
+            print(help_text, file=sys.stderr)
+            sys.exit(1)
+
+        with open(args.config, 'r') as f:
+            config = json.load(f)
+        config = with_row_filter(config, args.where, args.period_start, args.period_end, args.period_column)
+        if args.profile_query and not args.profile:
+            raise AnonymiserInputError("--profile-query needs --profile <report.json>.")
+        profiler = Profiler(args.profile, query_profile=args.profile_query) if args.profile else None
+
+        if "-" in args.input or args.output == "-":
+            if len(args.input) > 1 and "-" in args.input:
+                raise AnonymiserInputError("--input - (an Arrow stream on stdin) cannot be combined with other inputs.")
+            if args.jobs > 1 or args.resume or args.plan or args.preflight:
+                raise AnonymiserInputError("--jobs, --resume, --plan and --preflight need file input and output, not Arrow streams.")
+            anonymise_arrow_ipc(args.input, args.output, config, mode, mapping_store=args.mapping_store,
+                                resources=resource_options(args), profiler=profiler, partition_by=args.partition_by,
+                                row_group_size=args.row_group_size, compression=args.compression,
+                                per_thread_output=args.per_thread_output, overwrite=args.overwrite)
+            return
+
+        input_files = resolve_input_files(args.input)
+        for input_file in input_files:
+            validate_input_file(input_file)
+
+        if args.plan or args.preflight:
+            engine = Anonymiser(config, mode, resources=resource_options(args), profiler=profiler)
+            plan = engine.plan(input_files, materialise=args.materialise)
+            engine.con.close()
+            print(format_plan(plan))
+            if not plan["fits_memory_limit"]:
+                raise AnonymiserInputError(
+                    f"Estimated mapping memory {format_bytes(plan['estimated_mapping_bytes'])} exceeds the memory limit "
+                    f"{plan['memory_limit']}. Use inline strategies for high-cardinality columns, or raise --memory-limit.")
+            if args.plan:
+                if profiler:
+                    profiler.save("ok")
+                return
+            config = apply_plan(config, plan)
+
+        anonymise_inputs(input_files, args.output, config, mode, mapping_store=args.mapping_store,
+                         materialise=args.materialise, jobs=args.jobs, resume=args.resume,
+                         resources=resource_options(args), profiler=profiler, partition_by=args.partition_by,
+                         row_group_size=args.row_group_size, compression=args.compression,
+                         per_thread_output=args.per_thread_output, overwrite=args.overwrite)
+    except AnonymiserInputError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+def generate_config_entry(input_files: Union[str, List[str]], config_file: Optional[str] = None, mode: str = "legacy",
+                          resources: Optional[dict] = None, con: Any = None) -> None:
+    """
+    Generate a config file for the input file(s) and mode. Raises AnonymiserInputError if a file is empty or has no columns.
+    Parquet schemas are read from the file footers, in parallel and without running a query; columns that
+    only some files have are reported. CSV files are sniffed once and the result is cached in the config as
+    "csv_schema", so runs skip the sniffing. An existing config file is merged into: its actions and
+    settings are kept, and only columns it does not list yet are added. Its awsid_scheme is kept too, with
+    a missing key written out as DEFAULT_AWSID_SCHEME, so merging never changes the fake account IDs.
+    """
+    import json
+    input_files = resolve_input_files(input_files)
+    if input_format(input_files[0]) == "csv":
+        # If a file is 0 bytes, DuckDB reports a default column0; treat it as empty
+        if any(os.path.getsize(f) == 0 for f in input_files):
             raise AnonymiserInputError("Input file is empty (0 bytes, or DuckDB default column0 on empty file).")
+        con = con or connect(**(resources or {}))
+        csv_schema = sniff_csv_schema(con, input_files)
+        columns = list(csv_schema["columns"])
     else:
-        df = con.execute(f"SELECT * FROM read_parquet('{input_file}') LIMIT 0").fetchdf()
-        columns = list(df.columns)
+        csv_schema = None
+        columns, drift = union_columns(parquet_schemas(input_files))
         if not columns:
             raise AnonymiserInputError("Input file has no columns (empty or header-only).")
+        for col, files in drift.items():
+            shown = ", ".join(files[:3]) + (", ..." if len(files) > 3 else "")
+            # On stderr, so a config printed to stdout stays valid JSON
+            print(f"Column '{col}' is in {len(files)} of {len(input_files)} input files ({shown})", file=sys.stderr)
     config = generate_config(columns, mode=mode)
+    if config_file and os.path.exists(config_file):
+        with open(config_file) as f:
+            existing = json.load(f)
+        added = [col for col in config["columns"] if col not in existing.get("columns", {})]
+        config = {**config, **existing, "columns": {**existing.get("columns", {}),
+                                                   **{col: config["columns"][col] for col in added}}}
+        if "awsid_scheme" in config:
+            # Never the fresh "md5": a config without the key has been faking account IDs with the default
+            config["awsid_scheme"] = existing.get("awsid_scheme", DEFAULT_AWSID_SCHEME)
+        print(f"Merged into existing config: {len(added)} new column(s) added, existing actions kept")
+    if csv_schema:
+        # A cache of the input layout rather than a setting, so it is always refreshed
+        config["csv_schema"] = csv_schema
     if config_file:
         with open(config_file, "w") as f:
             json.dump(config, f, indent=2)
         print(f"Config file created at {config_file}")
     else:
-        print(json.dumps(config, indent=2)) 
\ No newline at end of file
+        print(json.dumps(config, indent=2))
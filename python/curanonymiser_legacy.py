@@ -33,10 +33,32 @@
 #   python curanonymiser_legacy.py --input rawcur_legacy.parquet --output anonymisedcur_legacy.csv --config config_legacy.json
 #
 # Flags:
-#   --input           Path to the input Parquet file (required)
-#   --output          Path to the output file (required unless --create-config is used)
+#   --input           Path(s) to the input Parquet, CSV or .csv.gz files: files, globs or directories, or - for an Arrow IPC stream on stdin (required)
+#   --output          Path to the output file, or - for an Arrow IPC stream on stdout (required unless --create-config is used)
 #   --config          Path to the JSON config file (required unless --create-config is used)
-#   --create-config   Generate a config file from the input Parquet file and exit
+#   --create-config   Generate (or extend) a config file from the input files and exit
+#   --where           Anonymise only the rows matching a DuckDB predicate; mappings are built from those rows only
+#   --period-start    Anonymise only the rows whose usage start date is on or after this date
+#   --period-end      Anonymise only the rows whose usage start date is before this date
+#   --period-column   Column the period applies to (default: the mode's usage start date column)
+#   --partition-by    Write a partitioned output directory, e.g. --partition-by 'month(line_item_usage_start_date)'
+#   --row-group-size  Rows per Parquet row group in the output
+#   --compression     Output compression codec (zstd, snappy, gzip, uncompressed)
+#   --per-thread-output  Write one output file per DuckDB thread into the output directory
+#   --overwrite       Replace an existing non-empty output directory
+#   --mapping-store   DuckDB file keeping mappings between runs; only newly seen values are anonymised
+#   --jobs            Anonymise input files in N processes, one output part per input file
+#   --resume          Checkpoint the run and skip work an interrupted run already finished
+#   --threads         DuckDB worker threads (default: one per CPU core)
+#   --memory-limit    DuckDB memory limit, e.g. 8GB; larger work spills to --temp-dir
+#   --temp-dir        Directory for DuckDB spill files (use fast local storage)
+#   --no-preserve-insertion-order  Stream the output without keeping input row order
+#   --profile         Write a JSON report of per-stage time, rows and peak memory to this file
+#   --profile-query   Add DuckDB's profile of the final query to the --profile report
+#   --materialise     Load the input into memory before anonymising (default: stream from the file)
+#   --plan            Print per-column statistics, strategies and memory/time estimates, then exit
+#   --preflight       Run the --plan pass first, fail fast if over the memory limit, then anonymise
+#   --batch           Run the JSON job lines of this file (- for stdin) in one process and connection
 #   --help            Show this help message and exit
 #
 # Column options for config:
@@ -46,27 +68,45 @@
 #   awsarn_anonymise  Anonymise as AWS ARN, using the fake account ID
 #   hash              Hash the column using DuckDB's md5_number_upper (same input = same output, not reversible)
 #   uuid              Replace the column value with a deterministic UUID (same input = same output, not reversible)
+#   json_tags         Keep tag keys and hash tag values of a JSON or MAP tag column, following tag_rules
 
-import argparse
-import duckdb
-import json
-import os
-import sys
-from anonymiser_common import parse_args, validate_input_file, generate_config_entry, build_awsid_mapping, build_arn_mapping, build_uuid_mapping, generate_config, AnonymiserInputError
+from anonymiser_common import cli_main
 
 HELP_TEXT = """
 Anonymise legacy AWS CUR Parquet files.
 
 Flags:
-  --input           Path to the input Parquet file (required)
-  --output          Path to the output file (required unless --create-config is used)
+  --input           Path(s) to the input Parquet, CSV or .csv.gz files: files, globs or directories, or - for an Arrow IPC stream on stdin (required)
+  --output          Path to the output file, or - for an Arrow IPC stream on stdout (required unless --create-config is used)
   --config          Path to the JSON config file (required unless --create-config is used)
-  --create-config   Generate a config file from the input Parquet file and exit
+  --create-config   Generate (or extend) a config file from the input files and exit
+  --where           Anonymise only the rows matching a DuckDB predicate; mappings are built from those rows only
+  --period-start    Anonymise only the rows whose usage start date is on or after this date
+  --period-end      Anonymise only the rows whose usage start date is before this date
+  --period-column   Column the period applies to (default: the mode's usage start date column)
+  --partition-by    Write a partitioned output directory, e.g. --partition-by 'month(line_item_usage_start_date)'
+  --row-group-size  Rows per Parquet row group in the output
+  --compression     Output compression codec (zstd, snappy, gzip, uncompressed)
+  --per-thread-output  Write one output file per DuckDB thread into the output directory
+  --overwrite       Replace an existing non-empty output directory
+  --mapping-store   DuckDB file keeping mappings between runs; only newly seen values are anonymised
+  --jobs            Anonymise input files in N processes, one output part per input file
+  --resume          Checkpoint the run and skip work an interrupted run already finished
+  --threads         DuckDB worker threads (default: one per CPU core)
+  --memory-limit    DuckDB memory limit, e.g. 8GB; larger work spills to --temp-dir
+  --temp-dir        Directory for DuckDB spill files (use fast local storage)
+  --no-preserve-insertion-order  Stream the output without keeping input row order
+  --profile         Write a JSON report of per-stage time, rows and peak memory to this file
+  --profile-query   Add DuckDB's profile of the final query to the --profile report
+  --materialise     Load the input into memory before anonymising (default: stream from the file)
+  --plan            Print per-column statistics, strategies and memory/time estimates, then exit
+  --preflight       Run the --plan pass first, fail fast if over the memory limit, then anonymise
+  --batch           Run the JSON job lines of this file (- for stdin) in one process and connection
 
 Config file options:
   The config file is a JSON file with this structure:
   {
-    "_comment": "Column options: 'keep', 'remove', 'awsid_anonymise', 'awsarn_anonymise', 'hash', 'uuid'",
+    "_comment": "Column options: 'keep', 'remove', 'awsid_anonymise', 'awsarn_anonymise', 'hash', 'uuid', 'json_tags'",
     "columns": {
       "column1": "keep",
       "column2": "remove",
@@ -74,6 +114,11 @@ Config file options:
       "column4": "awsarn_anonymise",
       "column5": "hash",
       "column6": "uuid"
+    },
+    "awsid_scheme": "md5",
+    "strategies": {
+      "column4": "inline",
+      "column6": "mapping"
     }
   }
 
@@ -84,6 +129,31 @@ Config file options:
     awsarn_anonymise  Anonymise as AWS ARN, using the fake account ID
     hash              Hash the column using DuckDB's md5_number_upper (same input = same output, not reversible)
     uuid              Replace the column value with a deterministic UUID (same input = same output, not reversible)
+    json_tags         Keep tag keys and hash tag values of a JSON or MAP tag column, following tag_rules
+
+  awsid_scheme (written as "md5" by --create-config; "random" when missing, as in configs from earlier releases):
+    md5               Fake account IDs are derived from the MD5 of the original ID, computed inside DuckDB
+    random            Reproduce the fake account IDs generated by earlier releases (slower, Python per ID)
+
+  tag_rules (optional, for json_tags columns, default {"*": "hash_value"}):
+    keep              Keep the tag key and value
+    hash_value        Keep the tag key, hash the value (the default, so tags still group cost allocation)
+    hash              Hash the tag key and the value
+    remove            Drop the tag
+    Keys are matched exactly; "*" sets the rule for every other key, e.g. {"user:CostCenter": "keep", "*": "hash_value"}
+
+  strategies (optional, per awsarn_anonymise or uuid column, default "auto"):
+    mapping           Build an original -> fake mapping table and join it back (best for repeated values)
+    inline            Compute the replacement for every row, with no mapping table or join (best for unique values)
+    auto              Inline when most sampled values are distinct, otherwise use a mapping
+
+  where / period (optional, the same as --where / --period-start / --period-end):
+    "where": "<DuckDB predicate>", "period": {"start": "2024-06-01", "end": "2024-07-01", "column": "lineItem/UsageStartDate"}
+    Only the matching rows are read (the filter is pushed into the scan) and used to build the mappings
+
+  csv_schema (written by --create-config for CSV and .csv.gz inputs):
+    The sniffed CSV dialect and column types, e.g. {"delim": ",", "header": true, "columns": {"lineItem/UsageStartDate": "TIMESTAMP"}}
+    Runs read CSV inputs with these explicit types instead of sniffing; fix a mis-inferred type here
 
 Examples:
   Create a config file:
@@ -91,101 +161,13 @@ Examples:
 
   Run anonymisation:
     python curanonymiser_legacy.py --input rawcur.parquet --output anonymisedcur.parquet --config config.json
+
+  Anonymise one month only:
+    python curanonymiser_legacy.py --input rawcur.parquet --output anonymisedcur.parquet --config config.json --period-start 2024-06-01 --period-end 2024-07-01
 """
 
 def main():
-    # Error handling for input validation is now done via AnonymiserInputError
-    try:
-        args = parse_args("Anonymise legacy AWS CUR Parquet files.", HELP_TEXT)
-
-        if args.create_config:
-            if not args.input:
-                print("Error: --input is required for --create-config", file=sys.stderr)
-                sys.exit(1)
-            generate_config_entry(args.input, args.config, mode="legacy")
-            sys.exit(0)
-
-        if not args.config or not args.output or not args.input:
-            print("Error: --input, --config and --output are required unless --create-config is used.\n", file=sys.stderr)
-            print(HELP_TEXT, file=sys.stderr)
-            sys.exit(1)
-
-        validate_input_file(args.input)
-
-        with open(args.config, 'r') as f:
-            config = json.load(f)
-        column_actions = config["columns"]
-
-        con = duckdb.connect()
-        ext = os.path.splitext(args.input)[1].lower()
-        if ext == ".csv":
-            con.execute(f'CREATE TABLE cur AS SELECT * FROM read_csv_auto(\'{args.input}\')')
-        else:
-            con.execute(f'CREATE TABLE cur AS SELECT * FROM read_parquet(\'{args.input}\')')
-
-        col_info = con.execute("PRAGMA table_info(cur)").fetchall()
-        if not col_info:
-            print("Error: Input file has no columns (empty or header-only).", file=sys.stderr)
-            sys.exit(1)
-        # Header-only files (zero rows) are allowed; do not error.
-
-        all_cols = [row[0] for row in con.execute("PRAGMA table_info(cur)").fetchall()]
-        keep_cols = [col for col, action in column_actions.items() if action in ("keep", "awsid_anonymise", "awsarn_anonymise", "hash", "uuid")]
-        anonymise_awsid_cols = [col for col, action in column_actions.items() if action == "awsid_anonymise"]
-        anonymise_arn_cols = [col for col, action in column_actions.items() if action == "awsarn_anonymise"]
-        hash_cols = [col for col, action in column_actions.items() if action == "hash"]
-        uuid_cols = [col for col, action in column_actions.items() if action == "uuid"]
-
-        mapping_tables = {}
-        for col in anonymise_awsid_cols:
-            mapping_tables[col] = build_awsid_mapping(con, "cur", col)
-
-        for col in anonymise_arn_cols:
-            possible_account_cols = [c for c in anonymise_awsid_cols if "account" in c.lower()]
-            if not possible_account_cols:
-                raise Exception(f"No account id column found for ARN column {col}")
-            account_col = possible_account_cols[0]
-            account_mapping_table = mapping_tables[account_col]
-            mapping_tables[col] = build_arn_mapping(con, "cur", col, account_col, account_mapping_table)
-
-        for col in uuid_cols:
-            mapping_tables[col] = build_uuid_mapping(con, "cur", col)
-
-        select_cols = []
-        join_clauses = []
-        already_joined = set()
-        for col in keep_cols:
-            if col in anonymise_awsid_cols or col in anonymise_arn_cols:
-                mt = mapping_tables[col]
-                select_cols.append(f'COALESCE(CAST({mt}.fake AS VARCHAR), CAST(cur."{col}" AS VARCHAR)) AS "{col}"')
-                if mt not in already_joined:
-                    join_clauses.append(f'LEFT JOIN {mt} ON cur."{col}" = {mt}.original')
-                    already_joined.add(mt)
-            elif col in uuid_cols:
-                mt = mapping_tables[col]
-                select_cols.append(f'COALESCE(CAST({mt}.fake AS VARCHAR), CAST(cur."{col}" AS VARCHAR)) AS "{col}"')
-                if mt not in already_joined:
-                    join_clauses.append(f'LEFT JOIN {mt} ON cur."{col}" = {mt}.original')
-                    already_joined.add(mt)
-            elif col in hash_cols:
-                select_cols.append(f'md5_number_upper(cur."{col}") AS "{col}"')
-            else:
-                select_cols.append(f'cur."{col}"')
-
-        select_sql = f'SELECT {', '.join(select_cols)} FROM cur ' + ' '.join(join_clauses)
-
-        output_file = args.output
-        output_ext = os.path.splitext(output_file)[1].lower()
-
-        if output_ext == ".csv":
-            con.execute(f"COPY ({select_sql}) TO '{output_file}' (FORMAT CSV, HEADER 1)")
-            print(f"Anonymised file written to {output_file} (CSV format)")
-        else:
-            con.execute(f"COPY ({select_sql}) TO '{output_file}' (FORMAT PARQUET)")
-            print(f"Anonymised file written to {output_file} (Parquet format)")
-    except AnonymiserInputError as e:
-        print(f"Error: {e}", file=sys.stderr)
-        sys.exit(1)
+    cli_main("legacy", "Anonymise legacy AWS CUR Parquet files.", HELP_TEXT)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,38 @@
+import json
+import os
+import subprocess
+import tempfile
+
+import duckdb
+import pytest
+
+BENCHMARKS = os.path.join(os.path.dirname(__file__), '..', 'benchmarks')
+
+
+@pytest.mark.parametrize("fmt", ["cur2", "legacy", "focus"])
+def test_generator_knobs(fmt):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output = os.path.join(temp_dir, f'{fmt}.parquet')
+        subprocess.run(["python3", os.path.join(BENCHMARKS, 'generate.py'), "--format", fmt, "--rows", "5000",
+                        "--accounts", "20", "--resources", "300", "--output", output], check=True)
+        resource = {"cur2": "line_item_resource_id", "legacy": "lineItem/ResourceId", "focus": "ResourceId"}[fmt]
+        rows, resources = duckdb.sql(f"""SELECT count(*), count(DISTINCT "{resource}") FROM '{output}'""").fetchone()
+        assert rows == 5000
+        assert 250 <= resources <= 300
+
+
+def test_benchmark_report():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        report_path = os.path.join(temp_dir, 'report.json')
+        subprocess.run(["python3", os.path.join(BENCHMARKS, 'run.py'), "--format", "cur2", "--rows", "2000",
+                        "--workdir", temp_dir, "--report", report_path], check=True)
+        with open(report_path) as f:
+            report = json.load(f)
+        assert report["environment"]["duckdb"] == duckdb.__version__
+        [run] = report["runs"]
+        names = [stage["name"] for stage in run["stages"]]
+        assert names[0] == "config" and names[-1] == "copy"
+        assert {"mapping:awsid", "mapping:uuid:line_item_resource_id", "mappings"} <= set(names)
+        assert all(stage["seconds"] >= 0 and stage["peak_rss_mb"] > 0 for stage in run["stages"])
+        # The generated files are cleaned up after each run
+        assert os.listdir(temp_dir) == ['report.json']
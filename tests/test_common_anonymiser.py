@@ -1,4 +1,5 @@
 import os
+import sys
 import tempfile
 import pytest
 from tests.test_utils import run_cli, read_csv, read_json
@@ -6,6 +7,9 @@ from collections import defaultdict
 import json
 import uuid
 
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'python')))
+import anonymiser_common
+
 ANONYMISERS = [
     {
         "name": "cur2",
@@ -37,6 +41,15 @@ def test_cli_help(anonymiser):
     assert result.returncode == 0
     assert "usage" in result.stdout.lower() or "help" in result.stdout.lower()
 
+@pytest.mark.parametrize("anonymiser", ANONYMISERS, ids=[a["name"] for a in ANONYMISERS])
+def test_help_and_version_do_not_import_duckdb(anonymiser):
+    import subprocess
+    script = os.path.join(os.path.dirname(__file__), anonymiser["script"])
+    for flag in ("--help", "--version"):
+        result = subprocess.run(["python3", "-X", "importtime", script, flag], capture_output=True, text=True, check=True)
+        imported = [line.rsplit("|", 1)[-1].strip() for line in result.stderr.splitlines() if line.startswith("import time:")]
+        assert "duckdb" not in imported
+
 @pytest.mark.parametrize("anonymiser", ANONYMISERS, ids=[a["name"] for a in ANONYMISERS])
 def test_config_generation(anonymiser):
     script = os.path.join(os.path.dirname(__file__), anonymiser["script"])
@@ -164,7 +177,7 @@ def test_output_structure(anonymiser):
         output_headers = output_rows[0].keys() if output_rows else []
         assert len(input_rows) == len(output_rows)
         config = read_json(config_path)
-        allowed_cols = [col for col, action in config['columns'].items() if action in ('keep', 'hash', 'uuid', 'awsid_anonymise', 'awsarn_anonymise')]
+        allowed_cols = [col for col, action in config['columns'].items() if action in ('keep', 'hash', 'uuid', 'awsid_anonymise', 'awsarn_anonymise', 'json_tags')]
         if output_headers:
             for col in output_headers:
                 assert col in allowed_cols
@@ -195,4 +208,691 @@ def test_cross_format_consistency(anonymiser):
             for col in rows_csv[0]:
                 vals_csv = [row[col] for row in rows_csv]
                 vals_parquet = [row[col] for row in rows_parquet]
-                assert vals_csv == vals_parquet 
\ No newline at end of file
+                assert vals_csv == vals_parquet 
+@pytest.mark.parametrize("anonymiser", ANONYMISERS, ids=[a["name"] for a in ANONYMISERS])
+def test_streaming_matches_materialised(anonymiser):
+    script = os.path.join(os.path.dirname(__file__), anonymiser["script"])
+    sample = os.path.join(os.path.dirname(__file__), anonymiser["sample"])
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config_path = os.path.join(temp_dir, 'config.json')
+        streamed = os.path.join(temp_dir, 'streamed.csv')
+        materialised = os.path.join(temp_dir, 'materialised.csv')
+        run_cli(script, ["--input", sample, "--create-config", "--config", config_path], check=True)
+        run_cli(script, ["--input", sample, "--output", streamed, "--config", config_path], check=True)
+        run_cli(script, ["--input", sample, "--output", materialised, "--config", config_path, "--materialise"], check=True)
+        assert read_csv(streamed) == read_csv(materialised)
+
+@pytest.mark.parametrize("scheme", anonymiser_common.AWSID_SCHEMES)
+def test_awsid_mapping_matches_python_generator(scheme):
+    import duckdb
+    con = duckdb.connect()
+    con.execute("CREATE TABLE cur AS SELECT * FROM (VALUES (123456789012), (12), (123456789012), (NULL)) t(acct)")
+    mt = anonymiser_common.build_awsid_mapping(con, "cur", "acct", scheme)
+    mapping = dict(con.execute(f"SELECT original, fake FROM {mt}").fetchall())
+    assert set(mapping) == {"123456789012", "12"}
+    for original, fake in mapping.items():
+        assert len(fake) == 12 and fake.isdigit()
+        assert fake == anonymiser_common.generate_fake_aws_account_id(original, scheme)
+
+def test_random_awsid_scheme_reproduces_earlier_ids():
+    import random
+    random.seed("123456789012")
+    expected = ''.join(random.choices('0123456789', k=12))
+    assert anonymiser_common.generate_fake_aws_account_id(123456789012, scheme="random") == expected
+    # The library defaults to the scheme a config without 'awsid_scheme' uses
+    assert anonymiser_common.generate_fake_aws_account_id(123456789012) == expected
+
+def test_arn_mapping_matches_python_rewrite():
+    import duckdb
+    arns = [
+        "arn:aws:ec2:us-east-1:123456789012:reservation/res-1",
+        "arn:aws:savingsplans::123456789012:savingsplan/sp-1",
+        "arn:aws:s3:::my-bucket/key:with:colons",
+        "arn:aws:lambda:eu-west-1:234567890123:function:name:alias",
+        "arn:aws:iam::345678901234:role/x\n",
+        "arn:aws:ec2:us-east-1:123456789012",
+        "i-1234567890abcdef0",
+        "",
+    ]
+    con = duckdb.connect()
+    con.execute("CREATE TABLE cur (arn VARCHAR, acct BIGINT)")
+    # The same ARN seen from several usage accounts must still map to exactly one fake ARN
+    con.executemany("INSERT INTO cur VALUES (?, ?)", [(arn, 123456789012) for arn in arns] + [(arns[0], 999999999999), (arns[0], None)])
+    account_table = anonymiser_common.build_account_dictionary(con, "cur", ["acct"], ["arn"])
+    mt = anonymiser_common.build_arn_mapping(con, "cur", "arn", account_table)
+    rows = con.execute(f"SELECT original, fake FROM {mt}").fetchall()
+    assert len(rows) == len(arns)
+    expected = set()
+    for arn in arns:
+        m = anonymiser_common.ARN_REGEX.match(arn)
+        fake_account = anonymiser_common.generate_fake_aws_account_id(m.group(4)) if m else None
+        expected.add((arn, anonymiser_common.generate_fake_arn(arn, fake_account)))
+    assert set(rows) == expected
+
+@pytest.mark.parametrize("anonymiser", ANONYMISERS, ids=[a["name"] for a in ANONYMISERS])
+def test_multi_file_input(anonymiser):
+    import shutil
+    script = os.path.join(os.path.dirname(__file__), anonymiser["script"])
+    sample = os.path.join(os.path.dirname(__file__), anonymiser["sample"])
+    ext = os.path.splitext(sample)[1]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        parts_dir = os.path.join(temp_dir, 'parts')
+        os.makedirs(os.path.join(parts_dir, 'month=2'))
+        shutil.copy(sample, os.path.join(parts_dir, f'part-1{ext}'))
+        shutil.copy(sample, os.path.join(parts_dir, 'month=2', f'part-2{ext}'))
+        config_path = os.path.join(temp_dir, 'config.json')
+        single = os.path.join(temp_dir, 'single.csv')
+        run_cli(script, ["--input", parts_dir, "--create-config", "--config", config_path], check=True)
+        run_cli(script, ["--input", sample, "--output", single, "--config", config_path], check=True)
+        single_rows = read_csv(single)
+        for inputs in ([parts_dir], [os.path.join(parts_dir, '**', f'*{ext}')],
+                       [os.path.join(parts_dir, f'part-1{ext}'), os.path.join(parts_dir, 'month=2', f'part-2{ext}')]):
+            output = os.path.join(temp_dir, 'output.csv')
+            run_cli(script, ["--input", *inputs, "--output", output, "--config", config_path], check=True)
+            rows = read_csv(output)
+            assert len(rows) == 2 * len(single_rows)
+            # Both parts share one mapping, so every part anonymises exactly like a single-file run
+            assert sorted(map(str, rows)) == sorted(map(str, single_rows + single_rows))
+
+@pytest.mark.parametrize("anonymiser", ANONYMISERS, ids=[a["name"] for a in ANONYMISERS])
+def test_parallel_parts_match_single_run(anonymiser):
+    import duckdb
+    import shutil
+    script = os.path.join(os.path.dirname(__file__), anonymiser["script"])
+    sample = os.path.join(os.path.dirname(__file__), anonymiser["sample"])
+    ext = os.path.splitext(sample)[1]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        parts_dir = os.path.join(temp_dir, 'parts')
+        os.makedirs(os.path.join(parts_dir, 'month=1'))
+        os.makedirs(os.path.join(parts_dir, 'month=2'))
+        shutil.copy(sample, os.path.join(parts_dir, 'month=1', f'part-0{ext}'))
+        shutil.copy(sample, os.path.join(parts_dir, 'month=2', f'part-0{ext}'))
+        config_path = os.path.join(temp_dir, 'config.json')
+        run_cli(script, ["--input", parts_dir, "--create-config", "--config", config_path], check=True)
+        config = read_json(config_path)
+        uuid_cols = ["ResourceId", "SubAccountName"] if anonymiser["name"] == "focus" else ["bill_billing_entity", "line_item_resource_id"]
+        for col in uuid_cols:
+            config["columns"][col] = "uuid"
+        with open(config_path, 'w') as f:
+            json.dump(config, f)
+        single = os.path.join(temp_dir, f'single{ext}')
+        run_cli(script, ["--input", parts_dir, "--output", single, "--config", config_path], check=True)
+        output_dir = os.path.join(temp_dir, 'output')
+        run_cli(script, ["--input", parts_dir, "--output", output_dir, "--config", config_path, "--jobs", "2"], check=True)
+        # One output part per input part, at the same relative path
+        for month in ('month=1', 'month=2'):
+            assert os.path.isfile(os.path.join(output_dir, month, f'part-0{ext}'))
+        rows = lambda path: sorted(map(str, duckdb.sql(f"SELECT CAST(COLUMNS(*) AS VARCHAR) FROM '{path}'").fetchall()))
+        assert rows(f"{output_dir}/*/*{ext}") == rows(single)
+
+def test_parallel_parts_with_schema_drift():
+    import duckdb
+    script = os.path.join(os.path.dirname(__file__), "../python/cur2anonymiser.py")
+    sample = os.path.join(os.path.dirname(__file__), "sample_cur2.parquet")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        parts_dir = os.path.join(temp_dir, 'parts')
+        os.makedirs(parts_dir)
+        # A month without line_item_resource_id, as when a column is added to the export
+        duckdb.sql(f"COPY (SELECT * EXCLUDE (line_item_resource_id) FROM '{sample}') TO '{parts_dir}/part-0.parquet'")
+        duckdb.sql(f"COPY (SELECT * FROM '{sample}') TO '{parts_dir}/part-1.parquet'")
+        config_path = os.path.join(temp_dir, 'config.json')
+        run_cli(script, ["--input", parts_dir, "--create-config", "--config", config_path], check=True)
+        single = os.path.join(temp_dir, 'single.parquet')
+        run_cli(script, ["--input", parts_dir, "--output", single, "--config", config_path], check=True)
+        output_dir = os.path.join(temp_dir, 'output')
+        run_cli(script, ["--input", parts_dir, "--output", output_dir, "--config", config_path, "--jobs", "2"], check=True)
+        rows = lambda path: sorted(map(str, duckdb.sql(
+            f"SELECT CAST(COLUMNS(*) AS VARCHAR) FROM read_parquet('{path}', union_by_name=true)").fetchall()))
+        assert rows(f"{output_dir}/*.parquet") == rows(single)
+        # Each part has the union's columns, the missing one as NULLs
+        part = duckdb.sql(f"SELECT count(line_item_resource_id), count(*) FROM '{output_dir}/part-0.parquet'").fetchone()
+        assert part[0] == 0 and part[1] > 0
+
+@pytest.mark.parametrize("anonymiser", ANONYMISERS, ids=[a["name"] for a in ANONYMISERS])
+def test_resume_skips_finished_parts(anonymiser):
+    import shutil
+    script = os.path.join(os.path.dirname(__file__), anonymiser["script"])
+    sample = os.path.join(os.path.dirname(__file__), anonymiser["sample"])
+    ext = os.path.splitext(sample)[1]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        parts_dir = os.path.join(temp_dir, 'parts')
+        os.makedirs(parts_dir)
+        for i in range(2):
+            shutil.copy(sample, os.path.join(parts_dir, f'part-{i}{ext}'))
+        config_path = os.path.join(temp_dir, 'config.json')
+        run_cli(script, ["--input", parts_dir, "--create-config", "--config", config_path], check=True)
+        config = read_json(config_path)
+        uuid_col = "ResourceId" if anonymiser["name"] == "focus" else "line_item_resource_id"
+        config["columns"][uuid_col] = "uuid"
+        config["strategies"] = {uuid_col: "mapping"}
+        with open(config_path, 'w') as f:
+            json.dump(config, f)
+        output_dir = os.path.join(temp_dir, 'output')
+        args = ["--input", parts_dir, "--output", output_dir, "--config", config_path, "--jobs", "2", "--resume"]
+        run_cli(script, args, check=True)
+        # Job files sit beside the output directory, not inside it
+        manifest_path = os.path.join(temp_dir, '.output.anonymiser-manifest.json')
+        manifest = read_json(manifest_path)
+        assert f"uuid:{uuid_col}" in manifest["stages"]
+        assert os.path.exists(os.path.join(temp_dir, '.output.anonymiser-mappings.duckdb'))
+        assert not [name for name in os.listdir(output_dir) if name.startswith('.')]
+        assert len(manifest["parts"]) == 2
+        # Simulate a run killed after writing part-0 only
+        lost = os.path.join(parts_dir, f'part-1{ext}')
+        del manifest["parts"][os.path.abspath(lost)]
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f)
+        os.remove(os.path.join(output_dir, f'part-1{ext}'))
+        kept = os.path.join(output_dir, f'part-0{ext}')
+        kept_mtime = os.path.getmtime(kept)
+        result = run_cli(script, args, check=True, capture_output=True)
+        assert "1 of 2 parts already anonymised" in result.stdout
+        assert os.path.exists(os.path.join(output_dir, f'part-1{ext}'))
+        assert os.path.getmtime(kept) == kept_mtime
+        assert len(read_json(manifest_path)["parts"]) == 2
+        assert not [name for name in os.listdir(output_dir) if name.startswith('.tmp-')]
+        # A manifest from a different config is never resumed
+        config["columns"][uuid_col] = "hash"
+        with open(config_path, 'w') as f:
+            json.dump(config, f)
+        result = run_cli(script, args, check=False, capture_output=True)
+        assert result.returncode == 1
+        assert "different config" in result.stderr
+
+def test_resource_controls():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        con = anonymiser_common.connect(threads=2, memory_limit="1GB", temp_dir=temp_dir, preserve_insertion_order=False)
+        settings = con.execute(
+            "SELECT current_setting('threads'), current_setting('temp_directory'), current_setting('preserve_insertion_order')"
+        ).fetchone()
+        assert settings == (2, temp_dir, False)
+        with pytest.raises(anonymiser_common.AnonymiserInputError):
+            anonymiser_common.connect(memory_limit="lots")
+    workers = anonymiser_common.split_resources({"threads": 8, "memory_limit": "4GB"}, 4)
+    assert workers["threads"] == 2
+    assert workers["memory_limit"] == f"{10 ** 9}B"
+    assert anonymiser_common.split_resources({"memory_limit": "80%"}, 4)["memory_limit"] == "80%"
+
+@pytest.mark.parametrize("anonymiser", ANONYMISERS, ids=[a["name"] for a in ANONYMISERS])
+def test_resource_flags(anonymiser):
+    script = os.path.join(os.path.dirname(__file__), anonymiser["script"])
+    sample = os.path.join(os.path.dirname(__file__), anonymiser["sample"])
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config_path = os.path.join(temp_dir, 'config.json')
+        resources = ["--threads", "2", "--memory-limit", "512MB", "--temp-dir", os.path.join(temp_dir, 'spill'),
+                     "--no-preserve-insertion-order"]
+        run_cli(script, ["--input", sample, "--create-config", "--config", config_path, *resources], check=True)
+        plain = os.path.join(temp_dir, 'plain.csv')
+        limited = os.path.join(temp_dir, 'limited.csv')
+        run_cli(script, ["--input", sample, "--output", plain, "--config", config_path], check=True)
+        run_cli(script, ["--input", sample, "--output", limited, "--config", config_path, *resources], check=True)
+        assert sorted(map(str, read_csv(limited))) == sorted(map(str, read_csv(plain)))
+
+@pytest.mark.parametrize("anonymiser", ANONYMISERS, ids=[a["name"] for a in ANONYMISERS])
+def test_mapping_store_reused_across_runs(anonymiser):
+    import duckdb
+    script = os.path.join(os.path.dirname(__file__), anonymiser["script"])
+    sample = os.path.join(os.path.dirname(__file__), anonymiser["sample"])
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config_path = os.path.join(temp_dir, 'config.json')
+        store = os.path.join(temp_dir, 'mappings.duckdb')
+        run_cli(script, ["--input", sample, "--create-config", "--config", config_path], check=True)
+        config = read_json(config_path)
+        uuid_cols = ["ResourceId", "SubAccountName"] if anonymiser["name"] == "focus" else ["bill_billing_entity", "line_item_resource_id"]
+        for col in uuid_cols:
+            config["columns"][col] = "uuid"
+        with open(config_path, 'w') as f:
+            json.dump(config, f)
+        plain = os.path.join(temp_dir, 'plain.csv')
+        run_cli(script, ["--input", sample, "--output", plain, "--config", config_path], check=True)
+        counts = []
+        for run in range(2):
+            output = os.path.join(temp_dir, f'stored_{run}.csv')
+            run_cli(script, ["--input", sample, "--output", output, "--config", config_path, "--mapping-store", store], check=True)
+            assert read_csv(output) == read_csv(plain)
+            con = duckdb.connect(store, read_only=True)
+            tables = [row[0] for row in con.execute("SELECT table_name FROM duckdb_tables()").fetchall()]
+            assert tables
+            counts.append({t: con.execute(f"SELECT count(*) FROM {t}").fetchone()[0] for t in tables})
+            con.close()
+        # The second run finds every value in the store and appends nothing
+        assert counts[0] == counts[1]
+
+PERIOD_COLUMNS = {"cur2": "line_item_usage_start_date", "legacy": "line_item_usage_start_date", "focus": "ChargePeriodStart"}
+
+@pytest.mark.parametrize("anonymiser", ANONYMISERS, ids=[a["name"] for a in ANONYMISERS])
+def test_partitioned_and_compressed_output(anonymiser):
+    import duckdb
+    script = os.path.join(os.path.dirname(__file__), anonymiser["script"])
+    sample = os.path.join(os.path.dirname(__file__), anonymiser["sample"])
+    period_col = PERIOD_COLUMNS[anonymiser["name"]]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config_path = os.path.join(temp_dir, 'config.json')
+        run_cli(script, ["--input", sample, "--create-config", "--config", config_path], check=True)
+        out_dir = os.path.join(temp_dir, 'out')
+        # A trailing separator, as in the README, names the same directory
+        args = ["--input", sample, "--output", out_dir + os.sep, "--config", config_path,
+                "--partition-by", f"month({period_col})", "--compression", "zstd"]
+        run_cli(script, args, check=True)
+        partitions = os.listdir(out_dir)
+        assert partitions and all(p.startswith(f"{period_col}_month=") for p in partitions)
+        con = duckdb.connect()
+        input_rows = con.execute(f"SELECT count(*) FROM '{sample}'").fetchone()[0]
+        files = f"{out_dir}/**/*.parquet"
+        assert con.execute(f"SELECT count(*) FROM read_parquet('{files}', hive_partitioning=false)").fetchone()[0] == input_rows
+        codecs = {row[0] for row in con.execute(f"SELECT compression FROM parquet_metadata('{files}')").fetchall()}
+        assert codecs == {"ZSTD"}
+        # An existing non-empty directory is only replaced with --overwrite
+        with open(os.path.join(out_dir, "notes.txt"), "w") as f:
+            f.write("keep me")
+        result = run_cli(script, args, check=False, capture_output=True)
+        assert result.returncode == 1 and "--overwrite" in result.stderr
+        assert os.path.exists(os.path.join(out_dir, "notes.txt"))
+        run_cli(script, args + ["--overwrite"], check=True)
+        assert sorted(os.listdir(out_dir)) == sorted(partitions)
+        # With --resume, the job files sit beside the directory, so it is written whole and then skipped
+        resumed = os.path.join(temp_dir, 'resumed')
+        resume_args = args[:3] + [resumed + os.sep] + args[4:] + ["--resume"]
+        run_cli(script, resume_args, check=True)
+        assert sorted(os.listdir(resumed)) == sorted(partitions)
+        assert os.path.exists(os.path.join(temp_dir, '.resumed.anonymiser-manifest.json'))
+        assert os.path.exists(os.path.join(temp_dir, '.resumed.anonymiser-mappings.duckdb'))
+        result = run_cli(script, resume_args, check=True, capture_output=True)
+        assert "already anonymised" in result.stdout
+        # Row group size is a Parquet-only option
+        with pytest.raises(Exception):
+            run_cli(script, ["--input", sample, "--output", os.path.join(temp_dir, 'out.csv'), "--config", config_path,
+                             "--row-group-size", "4096"], check=True)
+
+def test_plan_select_inline_and_join_agree(monkeypatch):
+    import duckdb
+    con = duckdb.connect()
+    con.execute("CREATE TABLE cur AS SELECT (i % 5) * 111111111111 AS payer, (i % 7) * 111111111111 AS usage, "
+                "'v' || (i % 3) AS tag, i AS cost FROM range(50) t(i)")
+    column_actions = {"payer": "awsid_anonymise", "usage": "awsid_anonymise", "tag": "uuid", "cost": "keep"}
+    accounts = anonymiser_common.build_account_dictionary(con, "cur", ["payer", "usage"])
+    mapping_tables = {"payer": accounts, "usage": accounts, "tag": anonymiser_common.build_uuid_mapping(con, "cur", "tag")}
+    inline_sql = anonymiser_common.plan_select(con, "cur", column_actions, mapping_tables)
+    assert "JOIN" not in inline_sql
+    monkeypatch.setattr(anonymiser_common, "INLINE_LOOKUP_MAX_ROWS", 0)
+    join_sql = anonymiser_common.plan_select(con, "cur", column_actions, mapping_tables)
+    # Each column is joined to its own mapping table; the account columns share the account dictionary
+    assert join_sql.count(f"LEFT JOIN {accounts} ") == 2 and join_sql.count("LEFT JOIN") == 3
+    assert not con.execute("SELECT 1 FROM duckdb_tables() WHERE table_name LIKE 'dict_%'").fetchall()
+    assert con.execute(inline_sql).fetchall() == con.execute(join_sql).fetchall()
+    with pytest.raises(anonymiser_common.AnonymiserInputError):
+        anonymiser_common.plan_select(con, "cur", {"cost": "notanaction"}, {})
+
+def test_account_dictionary_covers_all_account_columns():
+    import duckdb
+    con = duckdb.connect()
+    con.execute("CREATE TABLE cur (payer BIGINT, usage VARCHAR, arn VARCHAR)")
+    con.execute("INSERT INTO cur VALUES (111111111111, '222222222222', 'arn:aws:ec2:us-east-1:333333333333:reservation/r'), "
+                "(222222222222, NULL, 'arn:aws:s3:::bucket'), (NULL, '111111111111', NULL)")
+    mt = anonymiser_common.build_account_dictionary(con, "cur", ["payer", "usage"], ["arn"])
+    mapping = dict(con.execute(f"SELECT original, fake FROM {mt}").fetchall())
+    assert set(mapping) == {"111111111111", "222222222222", "333333333333"}
+    assert all(fake == anonymiser_common.generate_fake_aws_account_id(orig) for orig, fake in mapping.items())
+
+def test_uuid_mapping_matches_python_uuid5():
+    import duckdb
+    con = duckdb.connect()
+    con.execute("CREATE TABLE cur (s VARCHAR, n BIGINT, d DOUBLE, b BOOLEAN)")
+    con.executemany("INSERT INTO cur VALUES (?, ?, ?, ?)",
+                    [("abc", 1, 1.5, True), ("héllo wörld", -7, 1e-05, False), ("", 123456789012, 0.1, None), (None, None, None, None)])
+    for col in ["s", "n", "d", "b"]:
+        mt = anonymiser_common.build_uuid_mapping(con, "cur", col)
+        mapping = dict(con.execute(f"SELECT original, fake FROM {mt}").fetchall())
+        values = con.execute(f"SELECT DISTINCT {col}, CAST({col} AS VARCHAR) FROM cur WHERE {col} IS NOT NULL").fetchall()
+        assert len(mapping) == len(values)
+        for value, original in values:
+            assert mapping[original] == str(uuid.uuid5(uuid.NAMESPACE_DNS, str(value)))
+
+@pytest.mark.parametrize("anonymiser", ANONYMISERS, ids=[a["name"] for a in ANONYMISERS])
+def test_inline_and_mapping_strategies_agree(anonymiser):
+    script = os.path.join(os.path.dirname(__file__), anonymiser["script"])
+    sample = os.path.join(os.path.dirname(__file__), anonymiser["sample"])
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config_path = os.path.join(temp_dir, 'config.json')
+        run_cli(script, ["--input", sample, "--create-config", "--config", config_path], check=True)
+        config = read_json(config_path)
+        uuid_cols = ["ResourceId", "SubAccountName"] if anonymiser["name"] == "focus" else ["bill_billing_entity", "line_item_resource_id"]
+        for col in uuid_cols:
+            config["columns"][col] = "uuid"
+        strategy_cols = [col for col, action in config["columns"].items() if action in ("uuid", "awsarn_anonymise")]
+        outputs = {}
+        for strategy in ("inline", "mapping", "auto"):
+            config["strategies"] = {col: strategy for col in strategy_cols}
+            with open(config_path, 'w') as f:
+                json.dump(config, f)
+            outputs[strategy] = os.path.join(temp_dir, f'{strategy}.csv')
+            run_cli(script, ["--input", sample, "--output", outputs[strategy], "--config", config_path], check=True)
+        assert read_csv(outputs["inline"]) == read_csv(outputs["mapping"]) == read_csv(outputs["auto"])
+
+def test_auto_strategy_follows_cardinality():
+    import duckdb
+    con = duckdb.connect()
+    con.execute("CREATE TABLE cur AS SELECT 'id-' || i AS unique_id, 'v' || (i % 3) AS repeated FROM range(1000) t(i)")
+    assert anonymiser_common.choose_inline_fake_sql(con, "cur", "unique_id", "uuid") is not None
+    assert anonymiser_common.choose_inline_fake_sql(con, "cur", "repeated", "uuid") is None
+    assert anonymiser_common.choose_inline_fake_sql(con, "cur", "repeated", "uuid", "inline") is not None
+    assert anonymiser_common.choose_inline_fake_sql(con, "cur", "unique_id", "uuid", "mapping") is None
+    # The 'random' scheme's Python UDF would run per row: ARN columns keep their mapping
+    con.execute("CREATE TABLE arns AS SELECT 'arn:aws:ec2:us-east-1:' || (100000000000 + i) || ':instance/i-' || i AS arn FROM range(1000) t(i)")
+    assert anonymiser_common.choose_inline_fake_sql(con, "arns", "arn", "awsarn_anonymise", scheme="md5") is not None
+    assert anonymiser_common.choose_inline_fake_sql(con, "arns", "arn", "awsarn_anonymise", "inline", scheme="random") is None
+    plan = anonymiser_common.plan_columns(con, "arns", {"columns": {"arn": "awsarn_anonymise"}, "awsid_scheme": "random"})
+    assert plan["columns"]["arn"]["strategy"] == "mapping"
+
+def test_engine_anonymises_relations_in_process():
+    import duckdb
+    con = duckdb.connect()
+    con.execute("CREATE TABLE day1 AS SELECT '111111111111' AS acct, 'arn:aws:ec2:us-east-1:111111111111:instance/i-1' AS arn, "
+                "'res-a' AS res, 1.5 AS cost")
+    con.execute("CREATE TABLE day2 AS SELECT * FROM (VALUES ('111111111111', 'arn:aws:s3:::bucket', 'res-b', 2.5), "
+                "('222222222222', 'arn:aws:iam::222222222222:role/r', 'res-a', 3.5)) t(acct, arn, res, cost)")
+    config = {"columns": {"acct": "awsid_anonymise", "arn": "awsarn_anonymise", "res": "uuid", "cost": "keep"},
+              "strategies": {"arn": "mapping", "res": "mapping"}, "awsid_scheme": "md5"}
+    engine = anonymiser_common.Anonymiser(config, mode="cur2", con=con)
+    first = engine.anonymise(con.table("day1"))
+    second = engine.anonymise(con.sql("SELECT * FROM day2"))
+    # The first relation is lazy; the second call's mappings must extend, not replace, what it joins against
+    rows = first.fetchall() + second.fetchall()
+    fake = lambda original: anonymiser_common.generate_fake_aws_account_id(original, scheme="md5")
+    assert rows == [
+        (fake("111111111111"), f"arn:aws:ec2:us-east-1:{fake('111111111111')}:instance/i-1", str(uuid.uuid5(uuid.NAMESPACE_DNS, "res-a")), 1.5),
+        (fake("111111111111"), "arn:aws:s3:::bucket", str(uuid.uuid5(uuid.NAMESPACE_DNS, "res-b")), 2.5),
+        (fake("222222222222"), f"arn:aws:iam::{fake('222222222222')}:role/r", str(uuid.uuid5(uuid.NAMESPACE_DNS, "res-a")), 3.5),
+    ]
+    # A config from an earlier release has no awsid_scheme and keeps its fake IDs
+    legacy_config = {"columns": {"acct": "awsid_anonymise"}}
+    legacy = anonymiser_common.Anonymiser(legacy_config, mode="cur2", con=con).anonymise(con.table("day1")).fetchall()
+    assert legacy == [(anonymiser_common.generate_fake_aws_account_id("111111111111", scheme="random"),)]
+    with pytest.raises(anonymiser_common.AnonymiserInputError):
+        anonymiser_common.Anonymiser(config, mode="focus")
+
+def test_scans_read_only_the_columns_the_config_needs():
+    import duckdb
+    con = duckdb.connect()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "cur.parquet")
+        con.execute(f"COPY (SELECT '111111111111' AS acct, map(['k'], ['v']) AS product, 'x' AS unlisted, "
+                    f"1.5 AS cost) TO '{path}'")
+        config = {"columns": {"ACCT": "awsid_anonymise", "product": "remove", "cost": "keep"}, "awsid_scheme": "md5"}
+        engine = anonymiser_common.Anonymiser(config, mode="cur2", con=con)
+        assert con.table(engine.register(path, materialise=True)).columns == ["acct", "cost"]
+        assert con.table(engine.register(con.sql(f"SELECT * FROM '{path}'"))).columns == ["acct", "cost"]
+        plan = con.sql("EXPLAIN " + engine.select_sql(path)).fetchall()[0][1]
+        assert "READ_PARQUET" in plan and "product" not in plan and "unlisted" not in plan
+        fake = anonymiser_common.generate_fake_aws_account_id("111111111111", scheme="md5")
+        assert [row[0] for row in engine.anonymise(path).fetchall()] == [fake]
+
+def test_engine_arrow_in_and_out():
+    pa = pytest.importorskip("pyarrow")
+    sample = os.path.join(os.path.dirname(__file__), ANONYMISERS[0]["sample"])
+    engine = anonymiser_common.Anonymiser({"columns": {"line_item_usage_account_id": "awsid_anonymise", "line_item_unblended_cost": "keep"}})
+    expected = engine.anonymise(sample).fetchall()
+    table = pytest.importorskip("pyarrow.parquet").read_table(sample)
+    assert engine.anonymise(table).fetchall() == expected
+    # A record batch reader is consumed once, even though mappings and the final query both scan it
+    reader = engine.record_batches(pa.RecordBatchReader.from_batches(table.schema, table.to_batches()))
+    assert isinstance(reader, pa.RecordBatchReader)
+    assert reader.read_all().num_rows == len(expected)
+
+def test_engine_streams_readers_when_mappings_do_not_scan():
+    pa = pytest.importorskip("pyarrow")
+    table = pa.table({"res": ["a", "b", "a"], "cost": [1.0, 2.0, 3.0]})
+    config = {"columns": {"res": "uuid", "cost": "keep"}, "strategies": {"res": "inline"}}
+    engine = anonymiser_common.Anonymiser(config, mode="focus")
+    reader = engine.record_batches(pa.RecordBatchReader.from_batches(table.schema, table.to_batches()))
+    assert reader.read_all().column("res").to_pylist() == [str(uuid.uuid5(uuid.NAMESPACE_DNS, v)) for v in ["a", "b", "a"]]
+    # Inline-only configs never read the rows before the final query, so the reader is not copied into a table
+    assert not engine.con.execute("SELECT table_name FROM duckdb_tables() WHERE table_name LIKE 'anonymiser_source%'").fetchall()
+
+@pytest.mark.parametrize("anonymiser", ANONYMISERS, ids=[a["name"] for a in ANONYMISERS])
+def test_arrow_ipc_stdin_stdout(anonymiser):
+    import subprocess
+    pa = pytest.importorskip("pyarrow")
+    import duckdb
+    script = os.path.join(os.path.dirname(__file__), anonymiser["script"])
+    sample = os.path.join(os.path.dirname(__file__), anonymiser["sample"])
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config_path = os.path.join(temp_dir, 'config.json')
+        run_cli(script, ["--input", sample, "--create-config", "--config", config_path], check=True)
+        expected_path = os.path.join(temp_dir, 'expected.parquet')
+        run_cli(script, ["--input", sample, "--output", expected_path, "--config", config_path], check=True)
+        expected = duckdb.sql(f"SELECT CAST(COLUMNS(*) AS VARCHAR) FROM '{expected_path}'").fetchall()
+        sink = pa.BufferOutputStream()
+        source = duckdb.sql(f"SELECT * FROM '{sample}'").to_arrow_table()
+        with pa.ipc.new_stream(sink, source.schema) as writer:
+            writer.write_table(source)
+        result = subprocess.run(["python3", script, "--input", "-", "--output", "-", "--config", config_path],
+                                input=sink.getvalue().to_pybytes(), capture_output=True, check=True)
+        anonymised = pa.ipc.open_stream(result.stdout).read_all()
+        assert duckdb.sql("SELECT CAST(COLUMNS(*) AS VARCHAR) FROM anonymised").fetchall() == expected
+
+
+@pytest.mark.parametrize("anonymiser", ANONYMISERS, ids=[a["name"] for a in ANONYMISERS])
+def test_profile_report(anonymiser):
+    script = os.path.join(os.path.dirname(__file__), anonymiser["script"])
+    sample = os.path.join(os.path.dirname(__file__), anonymiser["sample"])
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config_path = os.path.join(temp_dir, 'config.json')
+        output_path = os.path.join(temp_dir, 'output.parquet')
+        report_path = os.path.join(temp_dir, 'profile.json')
+        run_cli(script, ["--input", sample, "--create-config", "--config", config_path], check=True)
+        run_cli(script, ["--input", sample, "--output", output_path, "--config", config_path,
+                         "--profile", report_path, "--profile-query"], check=True)
+        report = read_json(report_path)
+        assert report["status"] == "ok"
+        assert report["input_rows"] == report["output_rows"] > 0
+        stages = {stage["name"]: stage for stage in report["stages"]}
+        assert {"register", "mappings", "plan", "copy"} <= set(stages)
+        assert all(stage["distinct"] > 0 for name, stage in stages.items() if name.startswith("mapping:"))
+        assert stages["copy"]["rows"] == report["output_rows"]
+        # The input count never costs a scan: Parquet footers, or nothing for filtered CSV
+        run_cli(script, ["--input", sample, "--output", output_path, "--config", config_path,
+                         "--profile", report_path, "--where", "1 = 0"], check=True)
+        filtered = read_json(report_path)
+        assert filtered["output_rows"] == 0
+        assert filtered["input_rows"] == (report["input_rows"] if sample.endswith(".parquet") else None)
+        assert "query_profile" in stages["copy"]
+        assert all(stage["peak_rss_mb"] > 0 for stage in report["stages"])
+
+
+@pytest.mark.parametrize("anonymiser", ANONYMISERS, ids=[a["name"] for a in ANONYMISERS])
+def test_batch_runs_jobs_on_one_connection(anonymiser):
+    import subprocess
+    import duckdb
+    script = os.path.join(os.path.dirname(__file__), anonymiser["script"])
+    sample = os.path.join(os.path.dirname(__file__), anonymiser["sample"])
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config_path = os.path.join(temp_dir, 'config.json')
+        outputs = [os.path.join(temp_dir, f'output_{i}.parquet') for i in range(2)]
+        jobs = [{"input": sample, "create_config": config_path}]
+        jobs += [{"input": sample, "output": output, "config": config_path} for output in outputs]
+        jobs.append({"input": os.path.join(temp_dir, "missing.parquet"), "output": outputs[0]})
+        result = subprocess.run(["python3", script, "--batch", "-"], input="".join(json.dumps(job) + "\n" for job in jobs),
+                                capture_output=True, text=True)
+        results = [json.loads(line) for line in result.stdout.splitlines()]
+        assert [r["status"] for r in results] == ["ok", "ok", "ok", "failed"]
+        assert "config" in results[3]["error"]
+        assert result.returncode == 1
+        # Jobs sharing a config share the connection's mappings, so the same input anonymises identically
+        first, second = (duckdb.sql(f"SELECT CAST(COLUMNS(*) AS VARCHAR) FROM '{output}'").fetchall() for output in outputs)
+        assert first == second and results[1]["rows"] == len(first)
+
+
+def test_config_from_parquet_footers_unions_and_merges():
+    import subprocess
+    import duckdb
+    script = os.path.join(os.path.dirname(__file__), "../python/cur2anonymiser.py")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        parts = [os.path.join(temp_dir, f"part-{i}.parquet") for i in range(2)]
+        duckdb.sql(f"COPY (SELECT '123456789012' AS line_item_usage_account_id, {{'a': 1}} AS product, 1.5 AS cost) TO '{parts[0]}'")
+        duckdb.sql(f"COPY (SELECT '123456789012' AS line_item_usage_account_id, 1.5 AS cost, 'x' AS line_item_resource_id) TO '{parts[1]}'")
+        assert anonymiser_common.parquet_footer_columns(parts[0]) == (["line_item_usage_account_id", "product", "cost"], 1)
+        config_path = os.path.join(temp_dir, "config.json")
+        with open(config_path, "w") as f:
+            json.dump({"columns": {"cost": "remove"}, "strategies": {"cost": "inline"}}, f)
+        result = subprocess.run(["python3", "-X", "importtime", script, "--input", temp_dir, "--create-config",
+                                 "--config", config_path], capture_output=True, text=True, check=True)
+        # Footers are read without DuckDB or pandas
+        imported = [line.rsplit("|", 1)[-1].strip() for line in result.stderr.splitlines() if line.startswith("import time:")]
+        assert "duckdb" not in imported and "pandas" not in imported
+        assert "Column 'product' is in 1 of 2 input files" in result.stderr
+        assert "Column 'line_item_resource_id' is in 1 of 2 input files" in result.stderr
+        # Without --config the config goes to stdout, alone, as valid JSON
+        printed = subprocess.run(["python3", script, "--input", temp_dir, "--create-config"], capture_output=True,
+                                 text=True, check=True)
+        assert set(json.loads(printed.stdout)["columns"]) == {"line_item_usage_account_id", "product", "cost", "line_item_resource_id"}
+        assert json.loads(printed.stdout)["awsid_scheme"] == "md5"
+        config = read_json(config_path)
+        assert config["columns"] == {"cost": "remove", "line_item_usage_account_id": "awsid_anonymise",
+                                     "product": "keep", "line_item_resource_id": "keep"}
+        assert config["strategies"] == {"cost": "inline"}
+        # The merged config had no scheme key, i.e. it was faking IDs with the default: that is written out, not md5
+        assert config["awsid_scheme"] == anonymiser_common.DEFAULT_AWSID_SCHEME == "random"
+        config["awsid_scheme"] = "md5"
+        with open(config_path, "w") as f:
+            json.dump(config, f)
+        subprocess.run(["python3", script, "--input", temp_dir, "--create-config", "--config", config_path],
+                       capture_output=True, text=True, check=True)
+        assert read_json(config_path)["awsid_scheme"] == "md5"
+        with open(os.path.join(temp_dir, "not.parquet"), "wb") as f:
+            f.write(b"not a parquet file at all")
+        with pytest.raises(anonymiser_common.AnonymiserInputError):
+            anonymiser_common.parquet_footer_columns(os.path.join(temp_dir, "not.parquet"))
+
+
+def test_json_tags_follow_tag_rules():
+    import duckdb
+    con = duckdb.connect()
+    con.execute("""CREATE TABLE cur AS SELECT * FROM (VALUES
+        (map(['user:team', 'user:owner', 'aws:createdBy'], ['core', 'alice', 'x']), '{"team": "core", "owner": "bob"}'),
+        (map(['user:team', 'user:owner', 'aws:createdBy'], ['core', 'alice', 'x']), '{"team": "core", "owner": "bob"}'),
+        (map(['user:team'], ['web']), 'not json'),
+        (NULL, NULL),
+        (map(['user:team'], ['web']), '{"team": "a", "team": "b"}')) t(resource_tags, tags)""")
+    config = {"columns": {"resource_tags": "json_tags", "tags": "json_tags"},
+              "tag_rules": {"user:team": "keep", "team": "keep", "user:owner": "hash", "aws:createdBy": "remove"}}
+    engine = anonymiser_common.Anonymiser(config, con=con)
+    rows = con.sql(engine.select_sql(con.table("cur"))).fetchall()
+    md5 = lambda value: str(con.execute("SELECT md5_number_upper(?)", [value]).fetchone()[0])
+    # MAP columns stay MAPs; keys are kept, hashed or removed by rule, other values hashed
+    assert rows[0][0] == {"user:team": "core", md5("user:owner"): md5("alice")}
+    assert json.loads(rows[0][1]) == {"team": "core", "owner": md5("bob")}
+    assert rows[0] == rows[1]
+    assert rows[2] == ({"user:team": "web"}, md5("not json"))
+    assert rows[3] == (None, None)
+    # Duplicate keys cannot become a MAP: the whole blob is hashed rather than failing the run
+    assert rows[4] == ({"user:team": "web"}, md5('{"team": "a", "team": "b"}'))
+    # Each distinct tag set, and NULL, is anonymised once
+    mapping = [name for (name,) in con.execute("SELECT table_name FROM duckdb_tables() WHERE table_name LIKE 'tags_map_resource_tags_%'").fetchall()]
+    assert con.execute(f"SELECT count(*) FROM {mapping[0]}").fetchone()[0] == 3
+    with pytest.raises(anonymiser_common.AnonymiserInputError):
+        anonymiser_common.Anonymiser({**config, "tag_rules": {"team": "scramble"}}, con=con).select_sql(con.table("cur"))
+
+
+def test_plan_columns_statistics_and_strategies(monkeypatch):
+    import duckdb
+    con = duckdb.connect()
+    con.execute("""CREATE TABLE cur AS SELECT
+        lpad(CAST(i % 10 AS VARCHAR), 12, '0') AS account,
+        CASE WHEN i % 4 = 0 THEN NULL ELSE 'free text ' || (i % 3) END AS note,
+        'r-' || CAST(i AS VARCHAR) AS resource,
+        'team-' || CAST(i % 5 AS VARCHAR) AS team
+        FROM range(1000) t(i)""")
+    config = {"columns": {"account": "awsid_anonymise", "note": "awsid_anonymise", "resource": "uuid",
+                          "team": "uuid", "gone": "keep"}}
+    plan = anonymiser_common.plan_columns(con, "cur", config)
+    columns = plan["columns"]
+    assert plan["rows"] == 1000
+    assert columns["note"]["null_ratio"] == 0.25
+    assert columns["account"]["avg_bytes"] == 12
+    assert 900 <= columns["resource"]["distinct"] <= 1100
+    # Mostly distinct columns are computed inline, repeated ones get a mapping
+    assert columns["resource"]["strategy"] == "inline" and columns["team"]["strategy"] == "mapping"
+    assert anonymiser_common.apply_plan(config, plan)["strategies"] == {"resource": "inline", "team": "mapping"}
+    assert any("'note'" in warning and "12-digit" in warning for warning in plan["warnings"])
+    assert not any("'account'" in warning for warning in plan["warnings"])
+    assert any("'gone'" in warning for warning in plan["warnings"])
+    assert plan["fits_memory_limit"]
+    # Removed columns are projected away before the scan, but they are still in the input
+    engine = anonymiser_common.Anonymiser({"columns": {"ACCOUNT": "awsid_anonymise", "note": "remove", "gone": "remove"}}, con=con)
+    warnings = engine.plan(con.table("cur"))["warnings"]
+    assert warnings == ["Column 'gone' is in the config but not in the input."]
+    monkeypatch.setattr(anonymiser_common, "PLAN_ENTRY_OVERHEAD_BYTES", 10 ** 12)
+    assert not anonymiser_common.plan_columns(con, "cur", config)["fits_memory_limit"]
+
+
+def test_plan_and_preflight_cli():
+    import duckdb
+    script = os.path.join(os.path.dirname(__file__), "../python/cur2anonymiser.py")
+    sample = os.path.join(os.path.dirname(__file__), "sample_cur2.parquet")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config_path = os.path.join(temp_dir, 'config.json')
+        run_cli(script, ["--input", sample, "--create-config", "--config", config_path], check=True)
+        result = run_cli(script, ["--input", sample, "--config", config_path, "--plan"], check=True, capture_output=True)
+        assert "Estimated mapping memory" in result.stdout and "line_item_usage_account_id" in result.stdout
+        expected, planned = (os.path.join(temp_dir, name) for name in ('expected.parquet', 'planned.parquet'))
+        run_cli(script, ["--input", sample, "--output", expected, "--config", config_path], check=True)
+        run_cli(script, ["--input", sample, "--output", planned, "--config", config_path, "--preflight"], check=True)
+        rows = lambda path: duckdb.sql(f"SELECT CAST(COLUMNS(*) AS VARCHAR) FROM '{path}'").fetchall()
+        assert rows(planned) == rows(expected)
+
+def test_row_filter_and_period_window():
+    import duckdb
+    script = os.path.join(os.path.dirname(__file__), "../python/cur2anonymiser.py")
+    sample = os.path.join(os.path.dirname(__file__), "sample_cur2.parquet")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config_path, store = os.path.join(temp_dir, 'config.json'), os.path.join(temp_dir, 'mappings.duckdb')
+        run_cli(script, ["--input", sample, "--create-config", "--config", config_path], check=True)
+        full, window = (os.path.join(temp_dir, name) for name in ('full.parquet', 'window.parquet'))
+        run_cli(script, ["--input", sample, "--output", full, "--config", config_path], check=True)
+        run_cli(script, ["--input", sample, "--output", window, "--config", config_path, "--mapping-store", store,
+                         "--period-start", "2024-03-01", "--period-end", "2024-06-01",
+                         "--where", "line_item_product_code = 'AmazonEC2'"], check=True)
+        rows = lambda sql: duckdb.sql(f"SELECT CAST(COLUMNS(*) AS VARCHAR) FROM ({sql})").fetchall()
+        expected = rows(f"SELECT * FROM '{full}' WHERE line_item_usage_start_date >= '2024-03-01' "
+                        f"AND line_item_usage_start_date < '2024-06-01'")
+        assert len(expected) == 3 and rows(f"SELECT * FROM '{window}'") == expected
+        # The account dictionary only holds the accounts of the filtered rows
+        con = duckdb.connect(store, read_only=True)
+        accounts = con.execute("SELECT count(*) FROM map_awsid_md5").fetchone()[0]
+        con.close()
+        window_accounts = duckdb.sql(f"SELECT count(DISTINCT a) FROM (SELECT bill_payer_account_id AS a FROM '{window}' "
+                                     f"UNION SELECT line_item_usage_account_id FROM '{window}')").fetchone()[0]
+        assert accounts == window_accounts < 10
+        result = run_cli(script, ["--input", sample, "--output", window, "--config", config_path, "--where", "no_such_column = 1"],
+                         check=False, capture_output=True)
+        assert result.returncode == 1 and "Invalid row filter" in result.stderr
+
+def test_csv_schema_cached_in_config_and_gzip_input():
+    import duckdb
+    script = os.path.join(os.path.dirname(__file__), "../python/focusanonymiser.py")
+    sample = os.path.join(os.path.dirname(__file__), "sample_focus.csv")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        gzipped, config_path = os.path.join(temp_dir, "focus.csv.gz"), os.path.join(temp_dir, "config.json")
+        duckdb.execute(f"COPY (SELECT * FROM read_csv_auto('{sample}')) TO '{gzipped}' (HEADER 1)")
+        run_cli(script, ["--input", gzipped, "--create-config", "--config", config_path], check=True)
+        config = read_json(config_path)
+        schema = config["csv_schema"]
+        assert schema["delim"] == "," and schema["header"] is True and schema["columns"]["BilledCost"] == "DOUBLE"
+        assert list(schema["columns"]) == list(config["columns"])
+        reader = anonymiser_common.input_reader_sql([gzipped], anonymiser_common.cached_csv_schema([gzipped], config))
+        assert reader.startswith("read_csv(") and "auto_detect=false" in reader
+        # The BOM-prefixed sample has the same layout, so it is read with the cached schema too
+        assert anonymiser_common.cached_csv_schema([sample], config) is schema
+        cached, sniffed = (os.path.join(temp_dir, name) for name in ("cached.csv.gz", "sniffed.csv"))
+        run_cli(script, ["--input", gzipped, "--output", cached, "--config", config_path], check=True)
+        del config["csv_schema"]
+        with open(config_path, "w") as f:
+            json.dump(config, f)
+        run_cli(script, ["--input", sample, "--output", sniffed, "--config", config_path], check=True)
+        rows = lambda path: duckdb.sql(f"SELECT CAST(COLUMNS(*) AS VARCHAR) FROM '{path}'").fetchall()
+        assert len(rows(cached)) == 1000 and rows(cached) == rows(sniffed)
+        # A file whose header no longer matches the cached layout falls back to sniffing
+        other = os.path.join(temp_dir, "other.csv")
+        duckdb.execute(f"COPY (SELECT 1 AS a) TO '{other}' (HEADER 1)")
+        assert anonymiser_common.cached_csv_schema([other], {"csv_schema": schema}) is None